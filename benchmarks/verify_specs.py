@@ -0,0 +1,44 @@
+import argparse
+import sys
+from typing import Callable, Dict, List, Tuple
+
+from benchmarks.workloads import (Workload, db_workload, kvs_workload,
+                                  lists_push_workload)
+from wat.wat import verify_spec
+
+# The workloads to check every spec on. The traces are kept short enough to
+# be searched quickly.
+SPEC_WORKLOADS: List[Tuple[str, Callable[..., Workload], Dict[str, int]]] = [
+    ('kvs', kvs_workload, {'length': 12, 'keys': 3}),
+    ('lists', lists_push_workload, {'length': 8}),
+    ('db', db_workload, {'length': 6, 'relations': 3, 'domain': 3}),
+]
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Checks every provenance spec against the witnesses '
+                    'found by search on random traces.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--traces', type=int, default=100,
+                        help='The number of traces per workload.')
+    args = parser.parse_args()
+
+    failed = False
+    for name, generator, params in SPEC_WORKLOADS:
+        checked = 0
+        for seed in range(args.seed, args.seed + args.traces):
+            m, trace = generator(seed, **params)
+            correct = verify_spec(m, trace, len(trace) - 1)
+            if correct is None:
+                continue
+            checked += 1
+            if not correct:
+                failed = True
+                print(f'{name}: the spec is wrong for seed {seed}: {trace}')
+        print(f'{name}: checked {checked} of {args.traces} traces.')
+
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
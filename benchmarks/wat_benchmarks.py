@@ -0,0 +1,110 @@
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict, List, Tuple
+
+from benchmarks.workloads import BENCHMARKS, Benchmark
+from wat.stats import WatStats
+from wat.wat import wat
+
+def run_benchmark(benchmark: Benchmark,
+                  seed: int,
+                  repeat: int,
+                  use_specs: bool = False) \
+                  -> Dict[str, Any]:
+    # Time the query without tracemalloc, which slows down allocation.
+    seconds: List[float] = []
+    for _ in range(repeat):
+        m, trace = benchmark.generator(seed, **benchmark.params)
+        stats = WatStats()
+        start = time.perf_counter()
+        witnesses = wat(m, trace, len(trace) - 1, stats=stats,
+                        use_specs=use_specs)
+        seconds.append(time.perf_counter() - start)
+
+    m, trace = benchmark.generator(seed, **benchmark.params)
+    tracemalloc.start()
+    wat(m, trace, len(trace) - 1, use_specs=use_specs)
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'workload': benchmark.workload,
+        'params': benchmark.params,
+        'seed': seed,
+        'use_specs': use_specs,
+        'trace_length': len(trace),
+        'seconds': min(seconds),
+        'transitions': stats.transitions,
+        'replays': stats.replays,
+        'peak_bytes': peak_bytes,
+        'witnesses': len(witnesses),
+    }
+
+def _key(result: Dict[str, Any]) -> Tuple[str, str, int, bool]:
+    params = json.dumps(result['params'], sort_keys=True)
+    return (result['workload'], params, result['seed'],
+            result.get('use_specs', False))
+
+def compare(baseline: List[Dict[str, Any]],
+            results: List[Dict[str, Any]]) \
+            -> None:
+    """Prints how every result compares to the same benchmark in baseline."""
+    old = {_key(result): result for result in baseline}
+    print(f'{"workload":<20} {"params":<50} '
+          f'{"time":>8} {"transitions":>12} {"memory":>8}', file=sys.stderr)
+    for result in results:
+        workload, params, _, use_specs = _key(result)
+        if use_specs:
+            workload += ' (specs)'
+        if _key(result) not in old:
+            print(f'{workload:<20} {params:<50} (new)', file=sys.stderr)
+            continue
+        before = old[_key(result)]
+        ratios = [result[k] / before[k] if before[k] != 0 else float('nan')
+                  for k in ['seconds', 'transitions', 'peak_bytes']]
+        print(f'{workload:<20} {params:<50} {ratios[0]:>7.2f}x '
+              f'{ratios[1]:>11.2f}x {ratios[2]:>7.2f}x', file=sys.stderr)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Benchmarks wat on synthetic workloads. Every result is '
+                    'printed as a line of JSON.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Report the fastest of this many runs.')
+    parser.add_argument('--workload', action='append', default=[],
+                        help='Only run these workloads.')
+    parser.add_argument('--specs', action='store_true',
+                        help='Use a provenance spec instead of searching for '
+                             'witnesses when one applies. Spec queries do '
+                             'no transitions, so they are labelled (specs) '
+                             'when compared.')
+    parser.add_argument('--output', help='Also write the results here.')
+    parser.add_argument('--compare',
+                        help='Compare the results to an earlier --output.')
+    args = parser.parse_args()
+
+    results: List[Dict[str, Any]] = []
+    for benchmark in BENCHMARKS:
+        if args.workload and benchmark.workload not in args.workload:
+            continue
+        result = run_benchmark(benchmark, args.seed, args.repeat,
+                               args.specs)
+        results.append(result)
+        print(json.dumps(result), flush=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            for result in results:
+                f.write(json.dumps(result) + '\n')
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = [json.loads(line) for line in f if line.strip()]
+        compare(baseline, results)
+
+if __name__ == '__main__':
+    main()
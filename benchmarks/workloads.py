@@ -0,0 +1,213 @@
+import random
+from typing import Any, Callable, Dict, List, NamedTuple, Tuple
+
+from examples.white_box_examples import Kvs as WbKvs, SelfJoin, Tours
+from wat.bexpr import And, Bexpr, Expr, Not, Or, Var
+from wat.db import Db, DbCross, DbCup, DbDiff, DbProject, DbQuery, DbRelation
+from wat.kvs import Kvs
+from wat.lists import Lists
+from wat.state_machine import StateMachine
+from wat.wat import Trace
+from wat.white_box import Input
+
+# Every workload generator takes a seed and some size parameters and returns a
+# fresh state machine along with a trace of it. The last output of the trace is
+# the one whose provenance is benchmarked.
+Workload = Tuple[StateMachine, Trace]
+
+def kvs_workload(seed: int, length: int, keys: int) -> Workload:
+    rng = random.Random(seed)
+    m = Kvs()
+    inputs: List[Any] = []
+    for _ in range(length):
+        k = f'k{rng.randrange(keys)}'
+        r = rng.random()
+        if r < 0.6:
+            inputs.append(m.set(k, rng.randrange(4)))
+        elif r < 0.8:
+            inputs.append(m.add(k, rng.choice([-1, 1])))
+        else:
+            inputs.append(m.get(k))
+    inputs.append(m.get(f'k{rng.randrange(keys)}'))
+    return m, m.run(inputs)
+
+def lists_workload(seed: int, length: int, values: int) -> Workload:
+    rng = random.Random(seed)
+    m = Lists()
+    inputs: List[Any] = []
+    for _ in range(length):
+        x = f'x{rng.randrange(values)}'
+        r = rng.random()
+        if r < 0.35:
+            inputs.append(m.rpush(x))
+        elif r < 0.7:
+            inputs.append(m.lpush(x))
+        elif r < 0.8:
+            inputs.append(m.lpop())
+        elif r < 0.9:
+            inputs.append(m.rpop())
+        else:
+            inputs.append(m.remove(x))
+    inputs.append(rng.choice([m.index(rng.randrange(3)), m.lpop(), m.rpop()]))
+    return m, m.run(inputs)
+
+def lists_push_workload(seed: int, length: int) -> Workload:
+    """Pushes distinct values and then reads one of them."""
+    rng = random.Random(seed)
+    m = Lists()
+    inputs: List[Any] = []
+    for k in range(length):
+        r = rng.random()
+        if r < 0.45:
+            inputs.append(m.rpush(f'x{k}'))
+        elif r < 0.9:
+            inputs.append(m.lpush(f'x{k}'))
+        else:
+            inputs.append(m.index(rng.randrange(length)))
+    inputs.append(rng.choice([m.index(rng.randrange(length + 1)), m.lpop(),
+                              m.rpop()]))
+    return m, m.run(inputs)
+
+def _random_expr(rng: random.Random, variables: int, size: int) -> Expr:
+    if size <= 1:
+        return Var(f'v{rng.randrange(variables)}')
+    left = rng.randint(1, size - 1)
+    children = [_random_expr(rng, variables, left),
+                _random_expr(rng, variables, size - left)]
+    r = rng.random()
+    if r < 0.45:
+        return And(children)
+    elif r < 0.9:
+        return Or(children)
+    else:
+        return Not(Or(children))
+
+def bexpr_workload(seed: int,
+                   length: int,
+                   variables: int,
+                   expr_size: int) \
+                   -> Workload:
+    rng = random.Random(seed)
+    m = Bexpr()
+    inputs: List[Any] = []
+    for _ in range(length):
+        x = f'v{rng.randrange(variables)}'
+        if rng.random() < 0.7:
+            inputs.append(m.set(x))
+        else:
+            inputs.append(m.unset(x))
+    inputs.append(m.eval(_random_expr(rng, variables, expr_size)))
+    return m, m.run(inputs)
+
+def _random_query(rng: random.Random, relations: List[str]) -> DbQuery:
+    r, s = rng.sample(relations, 2)
+    return rng.choice([
+        DbDiff(DbRelation(r), DbRelation(s)),
+        DbCup(DbRelation(r), DbRelation(s)),
+        DbProject(DbCross(DbRelation(r), DbRelation(s)), [0]),
+    ])
+
+def db_workload(seed: int, length: int, relations: int, domain: int) \
+                -> Workload:
+    rng = random.Random(seed)
+    m = Db()
+    names = [f'R{k}' for k in range(relations)]
+    inputs: List[Any] = [m.create(r, 1) for r in names]
+    for _ in range(length):
+        inputs.append(m.insert(rng.choice(names),
+                               [f'a{rng.randrange(domain)}']))
+    inputs.append(m.query(_random_query(rng, names)))
+    return m, m.run(inputs)
+
+def wb_kvs_workload(seed: int, length: int, keys: int) -> Workload:
+    rng = random.Random(seed)
+    m = WbKvs()
+    inputs = [Input('set_req', (f'k{rng.randrange(keys)}',
+                                str(rng.randrange(4))))
+              for _ in range(length)]
+    inputs.append(Input('get_req', (f'k{rng.randrange(keys)}',)))
+    return m, m.run(inputs)
+
+def tours_workload(seed: int, length: int, names: int) -> Workload:
+    rng = random.Random(seed)
+    m = Tours()
+    inputs: List[Input] = []
+    for _ in range(length):
+        name = f'n{rng.randrange(names)}'
+        if rng.random() < 0.4:
+            inputs.append(Input('insert_agencies_req', (name, 'city', 'phone')))
+        else:
+            kind = rng.choice(['boat', 'bus'])
+            inputs.append(Input('insert_external_tours_req',
+                                (name, 'city', kind, '100')))
+    inputs.append(Input('query_req', ('',)))
+    return m, m.run(inputs)
+
+def self_join_workload(seed: int, length: int, domain: int) -> Workload:
+    rng = random.Random(seed)
+    m = SelfJoin()
+    inputs = [Input('insert_req', (f'a{rng.randrange(domain)}',
+                                   f'a{rng.randrange(domain)}'))
+              for _ in range(length)]
+    inputs.append(Input('query_req', ('',)))
+    return m, m.run(inputs)
+
+class Benchmark(NamedTuple):
+    workload: str
+    generator: Callable[..., Workload]
+    params: Dict[str, int]
+
+def _sweep(workload: str,
+           generator: Callable[..., Workload],
+           sweeps: List[Dict[str, int]]) \
+           -> List[Benchmark]:
+    return [Benchmark(workload, generator, params) for params in sweeps]
+
+# Only the traces of machines with footprints are sliced before they are
+# searched, so the other machines are swept over much shorter traces.
+BENCHMARKS: List[Benchmark] = (
+    _sweep('kvs', kvs_workload, [
+        {'length': 50, 'keys': 10},
+        {'length': 100, 'keys': 10},
+        {'length': 100, 'keys': 20},
+        {'length': 1000, 'keys': 100},
+        {'length': 1000, 'keys': 1000},
+    ]) +
+    _sweep('lists', lists_workload, [
+        {'length': 6, 'values': 3},
+        {'length': 8, 'values': 3},
+        {'length': 10, 'values': 3},
+        {'length': 10, 'values': 10},
+        {'length': 12, 'values': 10},
+    ]) +
+    _sweep('bexpr', bexpr_workload, [
+        {'length': 20, 'variables': 8, 'expr_size': 2},
+        {'length': 20, 'variables': 8, 'expr_size': 4},
+        {'length': 40, 'variables': 16, 'expr_size': 4},
+        {'length': 100, 'variables': 64, 'expr_size': 6},
+    ]) +
+    _sweep('db', db_workload, [
+        {'length': 6, 'relations': 2, 'domain': 3},
+        {'length': 8, 'relations': 2, 'domain': 3},
+        {'length': 10, 'relations': 4, 'domain': 3},
+        {'length': 20, 'relations': 8, 'domain': 3},
+    ]) +
+    _sweep('wb_kvs', wb_kvs_workload, [
+        {'length': 4, 'keys': 2},
+        {'length': 6, 'keys': 2},
+        {'length': 8, 'keys': 4},
+        {'length': 10, 'keys': 4},
+    ]) +
+    _sweep('tours', tours_workload, [
+        {'length': 4, 'names': 2},
+        {'length': 6, 'names': 2},
+        {'length': 8, 'names': 3},
+        {'length': 10, 'names': 3},
+    ]) +
+    _sweep('self_join', self_join_workload, [
+        {'length': 4, 'domain': 2},
+        {'length': 6, 'domain': 3},
+        {'length': 8, 'domain': 3},
+        {'length': 10, 'domain': 3},
+    ])
+)
@@ -31,15 +31,15 @@ def print_provenance(trace: Trace,
     print()
 
 class Kvs(WhiteBox):
-    def __init__(self) -> None:
-        WhiteBox.__init__(self)
+    def __init__(self, incremental: bool = False) -> None:
+        WhiteBox.__init__(self, incremental)
 
-        self.create_table('kvs', 2)            # kvs(k, v)
-        self.create_table('dont_clear', 1)     # dont_clear(_)
-        self.create_table('get_req', 1)        # get_req(k)
-        self.create_table('set_req', 2)        # set_req(k, v)
-        self.create_table('clear_req', 1)      # clear_req(_)
-        self.create_table('dont_clear_req', 1) # dont_clear_req(_)
+        self.create_table('kvs', 2, indexes=[[0]]) # kvs(k, v)
+        self.create_table('dont_clear', 1)         # dont_clear(_)
+        self.create_table('get_req', 1)            # get_req(k)
+        self.create_table('set_req', 2)            # set_req(k, v)
+        self.create_table('clear_req', 1)          # clear_req(_)
+        self.create_table('dont_clear_req', 1)     # dont_clear_req(_)
 
         kvs = WbRelation('kvs')
         dont_clear = WbRelation('dont_clear')
@@ -48,14 +48,10 @@ class Kvs(WhiteBox):
         clear_req = WbRelation('clear_req')
         dont_clear_req = WbRelation('dont_clear_req')
         self.register_rules('get_req', [
-            Rule('get_rep', (kvs * get_req)
-                             .select(lambda r: r[0] == r[2])
-                             .project([1]))
+            Rule('get_rep', kvs.join(get_req, [0], [0]).project([1]))
         ])
         self.register_rules('set_req', [
-            Rule('kvs', kvs - (kvs * set_req)
-                                .select(lambda r: r[0] == r[2])
-                                .project([0, 1])),
+            Rule('kvs', kvs - kvs.join(set_req, [0], [0]).project([0, 1])),
             Rule('kvs', kvs + set_req),
             Rule('set_rep', WbRecord(('ok',))),
         ])
@@ -69,12 +65,12 @@ class Kvs(WhiteBox):
         ])
 
 class SelfJoin(WhiteBox):
-    def __init__(self) -> None:
-        WhiteBox.__init__(self)
+    def __init__(self, incremental: bool = False) -> None:
+        WhiteBox.__init__(self, incremental)
 
-        self.create_table('R', 2)          # R(a, b)
-        self.create_table('insert_req', 2) # insert(a, b)
-        self.create_table('query_req', 1)  # query(_)
+        self.create_table('R', 2, indexes=[[0]]) # R(a, b)
+        self.create_table('insert_req', 2)       # insert(a, b)
+        self.create_table('query_req', 1)        # query(_)
 
         R = WbRelation('R')
         insert_req = WbRelation('insert_req')
@@ -84,17 +80,15 @@ class SelfJoin(WhiteBox):
             Rule('insert_rep', WbRecord(('ok', ))),
         ])
         self.register_rules('query_req', [
-            Rule('query_rep', (R * R)
-                                .select(lambda r: r[1] == r[2])
-                                .project([0])),
+            Rule('query_rep', R.join(R, [1], [0]).project([0])),
         ])
 
 class Tours(WhiteBox):
-    def __init__(self) -> None:
-        WhiteBox.__init__(self)
+    def __init__(self, incremental: bool = False) -> None:
+        WhiteBox.__init__(self, incremental)
 
         self.create_table('Agencies', 3)
-        self.create_table('ExternalTours', 4)
+        self.create_table('ExternalTours', 4, indexes=[[0]])
         self.create_table('insert_agencies_req', 3)
         self.create_table('insert_external_tours_req', 4)
         self.create_table('query_req', 1)
@@ -109,10 +103,12 @@ class Tours(WhiteBox):
 
         def f(t):
             a_name, a_based, a_phone, e_name, e_dest, e_type, e_price = t
-            return a_name == e_name and e_type == 'boat'
+            return e_type == 'boat'
         self.register_rules('query_req', [
             Rule('query_rep',
-                 (Agencies * ExternalTours).select(f).project([0, 2]))
+                 Agencies.join(ExternalTours, [0], [0])
+                         .select(f)
+                         .project([0, 2]))
         ])
         self.register_rules('cross_req', [
             Rule('cros_rep', Agencies * ExternalTours)
@@ -2,5 +2,11 @@ from .bexpr import *
 from .db import *
 from .kvs import *
 from .lists import *
+from .machines import *
+from .persistent import *
+from .result_cache import *
+from .specs import *
+from .stats import *
+from .trace_file import *
 from .wat import *
 from .white_box import *
@@ -0,0 +1,164 @@
+import argparse
+import json
+import sys
+import time
+from typing import Any, Dict, List
+
+from .machines import UnknownMachineError, make_machine
+from .stats import WatStats, WhiteBoxStats
+from .trace_file import TraceFileError, TraceReader
+from .wat import (Trace, _filter_happens_before, _indexes, _lexicographic_key,
+                  iter_wat, wat)
+from .white_box import WhiteBox
+
+# python -m wat runs provenance queries over a trace file, e.g.
+#
+#   python -m wat Kvs kvs.trace 7 9
+#   python -m wat examples.white_box_examples:Tours tours.trace 5 --lineage
+#
+# prints the wat provenance of outputs 7 and 9 of kvs.trace, and the lineage
+# that the Tours WhiteBox computes for output 5 of tours.trace.
+
+def _format_pair(trace: Trace, j: int) -> str:
+    i, o = trace[j]
+    return f'[{j}] {i}={o}'
+
+def _format_inputs(trace: Trace, indexes: List[int]) -> str:
+    return '; '.join(f'[{k}] {trace[k][0]}' for k in indexes)
+
+def _emit(args: argparse.Namespace,
+          trace: Trace,
+          j: int,
+          result: Dict[str, Any],
+          lines: List[str]) \
+          -> None:
+    if args.format == 'jsonl':
+        i, o = trace[j]
+        print(json.dumps(dict(j=j, input=str(i), output=str(o), **result)))
+    else:
+        print(_format_pair(trace, j))
+        for line in lines:
+            print(f'  {line}')
+        print()
+
+def _run_wat(args: argparse.Namespace, m: Any, trace: Trace) -> None:
+    deadline = None
+    if args.time_budget is not None:
+        deadline = time.time() + args.time_budget
+
+    for j in args.js:
+        stats = WatStats()
+        if deadline is None:
+            witnesses = [[k for (k, _, _) in w]
+                         for w in wat(m, trace, j, workers=args.workers,
+                                      stats=stats, use_specs=not args.no_specs)]
+            complete = True
+        else:
+            # iter_wat does not drop the witnesses that happen before another,
+            # so we drop them once the search is over. If it was cut short, we
+            # cannot tell which to drop and report every witness found.
+            masks = [sum(1 << k for (k, _, _) in w)
+                     for w in iter_wat(m, trace, j, deadline=deadline,
+                                       stats=stats)]
+            complete = stats.deadlines_exceeded == 0
+            if complete:
+                masks.sort(key=_lexicographic_key)
+                masks = _filter_happens_before(masks)
+            witnesses = [_indexes(mask) for mask in masks]
+
+        lines = [f'- {_format_inputs(trace, w)}' for w in witnesses]
+        if not complete:
+            lines.append('(time budget exceeded, some witnesses are missing)')
+        lines.append(str(stats))
+        _emit(args, trace, j,
+              dict(witnesses=witnesses, complete=complete,
+                   stats=stats.as_dict()),
+              lines)
+
+def _run_lineage(args: argparse.Namespace, m: WhiteBox, trace: Trace) -> None:
+    stats = WhiteBoxStats()
+    m.stats = stats
+    start = time.perf_counter()
+    m.run([i for (i, _) in trace[:max(args.js) + 1]])
+    seconds = time.perf_counter() - start
+
+    for j in args.js:
+        start = time.perf_counter()
+        lineage = m.get_output_lineage(j)
+        lineage_seconds = time.perf_counter() - start
+        records: List[Dict[str, Any]] = []
+        lines: List[str] = []
+        for rid, t in lineage.items():
+            indexes = [k for (k, _, _) in t]
+            records.append(dict(record=list(rid.record), inputs=indexes))
+            lines.append(f'{rid.record}')
+            lines.append(f'  - {_format_inputs(trace, indexes)}')
+        lines.append(f'transitions={stats.transitions}, '
+                     f'run_seconds={seconds}, '
+                     f'lineage_seconds={lineage_seconds}')
+        _emit(args, trace, j,
+              dict(lineage=records, transitions=stats.transitions,
+                   run_seconds=seconds, lineage_seconds=lineage_seconds),
+              lines)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog='python -m wat',
+        description='Computes the provenance of outputs in a trace file.')
+    parser.add_argument('machine',
+                        help='Bexpr, Db, Kvs, Lists, or a StateMachine '
+                             'subclass given as module:Class.')
+    parser.add_argument('trace', help='The trace file.')
+    parser.add_argument('js', type=int, nargs='*', metavar='j',
+                        help='The indexes of the outputs to explain. '
+                             'Negative indexes count from the end. Defaults '
+                             'to the last output.')
+    parser.add_argument('--lineage', action='store_true',
+                        help="Report the WhiteBox machine's lineage instead "
+                             'of running wat.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='The number of processes to search with.')
+    parser.add_argument('--time-budget', type=float,
+                        help='Stop searching for witnesses after this many '
+                             'seconds, over all the outputs.')
+    parser.add_argument('--no-specs', action='store_true',
+                        help='Search for witnesses even if a provenance spec '
+                             'applies.')
+    parser.add_argument('--format', choices=['text', 'jsonl'], default='text',
+                        help='Print text, or one JSON object per output.')
+    parser.add_argument('--trust', action='append', default=['wat'],
+                        help='A package that the trace file may load classes '
+                             'from. Can be repeated.')
+    args = parser.parse_args()
+
+    if args.workers < 1:
+        parser.error('--workers must be at least 1.')
+    if args.workers > 1 and args.time_budget is not None:
+        parser.error('--workers and --time-budget cannot be combined.')
+    if args.lineage and (args.workers > 1 or args.time_budget is not None):
+        parser.error('--lineage cannot be combined with --workers or '
+                     '--time-budget.')
+
+    try:
+        m = make_machine(args.machine)
+        with TraceReader(args.trace, tuple(args.trust)) as reader:
+            n = len(reader)
+            js = args.js if len(args.js) > 0 else [-1]
+            for j in js:
+                if not -n <= j < n:
+                    sys.exit(f'error: j={j} is out of range for a trace of '
+                             f'length {n}.')
+            args.js = [j % n for j in js]
+            # Only the inputs up to the last queried output are read.
+            trace = reader[:max(args.js) + 1]
+    except (UnknownMachineError, TraceFileError, OSError) as e:
+        sys.exit(f'error: {e}')
+    if args.lineage:
+        if not isinstance(m, WhiteBox):
+            parser.error(f'{args.machine} is not a WhiteBox.')
+        _run_lineage(args, m, trace)
+    else:
+        _run_wat(args, m, trace)
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,23 @@
-from typing import Dict, List, NamedTuple, Optional, Union
+from typing import Dict, List, NamedTuple, Optional, Set, Union
 
-from .state_machine import StateMachine
+from .state_machine import StateMachine, mask_column
 
 class Expr:
     def eval(self, env: Dict[str, bool]) -> bool:
         raise NotImplementedError()
 
+    def eval_batch(self, env: Dict[str, int], everything: int) -> int:
+        """Evaluates the expression in many environments at once.
+
+        Bit b of env[x] is set if x is true in the bth environment, and bit b
+        of the result is the value of the expression in it. everything has a
+        bit set for every environment.
+        """
+        raise NotImplementedError()
+
+    def variables(self) -> Set[str]:
+        raise NotImplementedError()
+
 class Top(Expr):
     def __str__(self) -> str:
         return 'true'
@@ -16,6 +28,12 @@ class Top(Expr):
     def eval(self, env: Dict[str, bool]) -> bool:
         return True
 
+    def eval_batch(self, env: Dict[str, int], everything: int) -> int:
+        return everything
+
+    def variables(self) -> Set[str]:
+        return set()
+
 class Bot(Expr):
     def __str__(self) -> str:
         return 'false'
@@ -26,6 +44,12 @@ class Bot(Expr):
     def eval(self, env: Dict[str, bool]) -> bool:
         return False
 
+    def eval_batch(self, env: Dict[str, int], everything: int) -> int:
+        return 0
+
+    def variables(self) -> Set[str]:
+        return set()
+
 class Var(Expr):
     def __init__(self, x: str) -> None:
         self.x = x
@@ -39,6 +63,12 @@ class Var(Expr):
     def eval(self, env: Dict[str, bool]) -> bool:
         return env.get(self.x, False)
 
+    def eval_batch(self, env: Dict[str, int], everything: int) -> int:
+        return env.get(self.x, 0)
+
+    def variables(self) -> Set[str]:
+        return {self.x}
+
 class And(Expr):
     def __init__(self, children: List[Expr]) -> None:
         self.children = children
@@ -52,6 +82,15 @@ class And(Expr):
     def eval(self, env: Dict[str, bool]) -> bool:
         return all(child.eval(env) for child in self.children)
 
+    def eval_batch(self, env: Dict[str, int], everything: int) -> int:
+        result = everything
+        for child in self.children:
+            result &= child.eval_batch(env, everything)
+        return result
+
+    def variables(self) -> Set[str]:
+        return set().union(*(child.variables() for child in self.children))
+
 class Or(Expr):
     def __init__(self, children: List[Expr]) -> None:
         self.children = children
@@ -65,6 +104,15 @@ class Or(Expr):
     def eval(self, env: Dict[str, bool]) -> bool:
         return any(child.eval(env) for child in self.children)
 
+    def eval_batch(self, env: Dict[str, int], everything: int) -> int:
+        result = 0
+        for child in self.children:
+            result |= child.eval_batch(env, everything)
+        return result
+
+    def variables(self) -> Set[str]:
+        return set().union(*(child.variables() for child in self.children))
+
 class Not(Expr):
     def __init__(self, child: Expr) -> None:
         self.child = child
@@ -78,6 +126,12 @@ class Not(Expr):
     def eval(self, env: Dict[str, bool]) -> bool:
         return not self.child.eval(env)
 
+    def eval_batch(self, env: Dict[str, int], everything: int) -> int:
+        return everything & ~self.child.eval_batch(env, everything)
+
+    def variables(self) -> Set[str]:
+        return self.child.variables()
+
 class BexprEvalRequest(NamedTuple):
     e: Expr
 
@@ -147,6 +201,50 @@ class Bexpr(StateMachine[Input, Output]):
     def reset(self) -> None:
         self.env = dict()
 
+    # override.
+    def snapshot(self) -> Dict[str, bool]:
+        return dict(self.env)
+
+    # override.
+    def restore(self, state: Dict[str, bool]) -> None:
+        self.env = dict(state)
+
+    # override.
+    def footprint(self, i: Input) -> Set[str]:
+        if isinstance(i, BexprEvalRequest):
+            return i.e.variables()
+        else:
+            return {i.k}
+
+    # override.
+    def run_batch(self, inputs: List[Input], masks: List[int], i: Input) \
+                  -> List[Output]:
+        if isinstance(i, BexprSetRequest):
+            return [BexprSetReply()] * len(masks)
+        elif isinstance(i, BexprUnsetRequest):
+            return [BexprUnsetReply()] * len(masks)
+        elif not isinstance(i, BexprEvalRequest):
+            raise ValueError(f'Unrecognized input "{i}".')
+
+        # env maps every variable of the expression to the masks in which it
+        # is true.
+        variables = i.e.variables()
+        env: Dict[str, int] = dict()
+        for j, x in enumerate(inputs):
+            if isinstance(x, BexprEvalRequest) or x.k not in variables:
+                continue
+            column = mask_column(masks, j)
+            if isinstance(x, BexprSetRequest):
+                env[x.k] = env.get(x.k, 0) | column
+            elif isinstance(x, BexprUnsetRequest):
+                env[x.k] = env.get(x.k, 0) & ~column
+            else:
+                raise ValueError(f'Unrecognized input "{x}".')
+
+        result = i.e.eval_batch(env, (1 << len(masks)) - 1)
+        return [BexprEvalReply(bool(result >> b & 1))
+                for b in range(len(masks))]
+
     # override.
     def transition(self, i: Input) -> Output:
         if isinstance(i, BexprEvalRequest):
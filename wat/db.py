@@ -1,26 +1,42 @@
-from typing import (Callable, Dict, List, NamedTuple, Tuple, Optional, Set,
-                    Union)
+from typing import (AbstractSet, Callable, Dict, List, Mapping, MutableSet,
+                    NamedTuple, Tuple, Optional, Set, Union)
+import copy
 
+from .persistent import CowSet
 from .state_machine import StateMachine
 
 Record = Tuple[str, ...]
+DbRelations = Mapping[str, AbstractSet[Record]]
 
 class DbQueryException(Exception):
     pass
 
 class DbQuery:
-    def eval(self, db: Dict[str, Set[Record]]) -> Set[Record]:
+    def eval(self, db: DbRelations) -> AbstractSet[Record]:
         raise NotImplementedError()
 
+    def relations(self) -> Set[str]:
+        raise NotImplementedError()
+
+    def join(self,
+             other: 'DbQuery',
+             lhs_columns: List[int],
+             rhs_columns: List[int]) \
+             -> 'DbJoin':
+        return DbJoin(self, other, lhs_columns, rhs_columns)
+
 class DbRelation(DbQuery):
     def __init__(self, r: str) -> None:
         self.r = r
 
-    def eval(self, db: Dict[str, Set[Record]]) -> Set[Record]:
+    def eval(self, db: DbRelations) -> AbstractSet[Record]:
         if self.r not in db:
             raise DbQueryException(f'{self.r} not in {db}.')
         return db[self.r]
 
+    def relations(self) -> Set[str]:
+        return {self.r}
+
     def __str__(self) -> str:
         return f'{self.r}'
 
@@ -32,9 +48,12 @@ class DbSelect(DbQuery):
         self.child = child
         self.f = f
 
-    def eval(self, db: Dict[str, Set[Record]]) -> Set[Record]:
+    def eval(self, db: DbRelations) -> AbstractSet[Record]:
         return {t for t in self.child.eval(db) if self.f(t)}
 
+    def relations(self) -> Set[str]:
+        return self.child.relations()
+
     def __str__(self) -> str:
         return f'Select({self.child}, {self.f})'
 
@@ -46,9 +65,12 @@ class DbProject(DbQuery):
         self.child = child
         self.indexes = indexes
 
-    def eval(self, db: Dict[str, Set[Record]]) -> Set[Record]:
+    def eval(self, db: DbRelations) -> AbstractSet[Record]:
         return {tuple(t[i] for i in self.indexes) for t in self.child.eval(db)}
 
+    def relations(self) -> Set[str]:
+        return self.child.relations()
+
     def __str__(self) -> str:
         return f'Project({self.child}, {self.indexes})'
 
@@ -60,10 +82,17 @@ class DbCross(DbQuery):
         self.lhs = lhs
         self.rhs = rhs
 
-    def eval(self, db: Dict[str, Set[Record]]) -> Set[Record]:
-        return {lhs + rhs
-                for lhs in self.lhs.eval(db)
-                for rhs in self.rhs.eval(db)}
+    def eval(self, db: DbRelations) -> AbstractSet[Record]:
+        # The right-hand side is only evaluated if the left-hand side is not
+        # empty, so it can read a relation that does not exist.
+        lhs = self.lhs.eval(db)
+        if len(lhs) == 0:
+            return set()
+        rhs = self.rhs.eval(db)
+        return {l + r for l in lhs for r in rhs}
+
+    def relations(self) -> Set[str]:
+        return self.lhs.relations() | self.rhs.relations()
 
     def __str__(self) -> str:
         return f'Cross({self.lhs}, {self.rhs})'
@@ -71,14 +100,60 @@ class DbCross(DbQuery):
     def __repr__(self) -> str:
         return str(self)
 
+class DbJoin(DbQuery):
+    """An equijoin, computed with a hash join.
+
+    DbJoin(lhs, rhs, [0], [1]) evaluates to the same records as
+    DbSelect(DbCross(lhs, rhs), lambda t: t[0] == t[n + 1]), where n is the
+    arity of lhs, but it does not build the cross product.
+    """
+    def __init__(self,
+                 lhs: DbQuery,
+                 rhs: DbQuery,
+                 lhs_columns: List[int],
+                 rhs_columns: List[int]) -> None:
+        assert len(lhs_columns) == len(rhs_columns), (lhs_columns, rhs_columns)
+        self.lhs = lhs
+        self.rhs = rhs
+        self.lhs_columns = lhs_columns
+        self.rhs_columns = rhs_columns
+
+    def eval(self, db: DbRelations) -> AbstractSet[Record]:
+        # Like a cross product, the right-hand side is only evaluated if the
+        # left-hand side is not empty.
+        lhs = self.lhs.eval(db)
+        if len(lhs) == 0:
+            return set()
+
+        table: Dict[Record, List[Record]] = dict()
+        for r in self.rhs.eval(db):
+            key = tuple(r[i] for i in self.rhs_columns)
+            table.setdefault(key, []).append(r)
+        return {l + r
+                for l in lhs
+                for r in table.get(tuple(l[i] for i in self.lhs_columns), [])}
+
+    def relations(self) -> Set[str]:
+        return self.lhs.relations() | self.rhs.relations()
+
+    def __str__(self) -> str:
+        return (f'Join({self.lhs}, {self.rhs}, {self.lhs_columns}, '
+                f'{self.rhs_columns})')
+
+    def __repr__(self) -> str:
+        return str(self)
+
 class DbCup(DbQuery):
     def __init__(self, lhs: DbQuery, rhs: DbQuery) -> None:
         self.lhs = lhs
         self.rhs = rhs
 
-    def eval(self, db: Dict[str, Set[Record]]) -> Set[Record]:
+    def eval(self, db: DbRelations) -> AbstractSet[Record]:
         return self.lhs.eval(db) | self.rhs.eval(db)
 
+    def relations(self) -> Set[str]:
+        return self.lhs.relations() | self.rhs.relations()
+
     def __str__(self) -> str:
         return f'Cup({self.lhs}, {self.rhs})'
 
@@ -90,9 +165,12 @@ class DbDiff(DbQuery):
         self.lhs = lhs
         self.rhs = rhs
 
-    def eval(self, db: Dict[str, Set[Record]]) -> Set[Record]:
+    def eval(self, db: DbRelations) -> AbstractSet[Record]:
         return self.lhs.eval(db) - self.rhs.eval(db)
 
+    def relations(self) -> Set[str]:
+        return self.lhs.relations() | self.rhs.relations()
+
     def __str__(self) -> str:
         return f'Diff({self.lhs}, {self.rhs})'
 
@@ -166,7 +244,7 @@ class DbQueryRequest(NamedTuple):
         return str(self)
 
 class DbQueryReply(NamedTuple):
-    result: Optional[Set[Record]]
+    result: Optional[AbstractSet[Record]]
 
     def __str__(self) -> str:
         return f'{self.result}'
@@ -177,8 +255,15 @@ class DbQueryReply(NamedTuple):
 Input = Union[DbCreateRequest, DbInsertRequest, DbDeleteRequest, DbQueryRequest]
 Output = Union[DbCreateReply, DbInsertReply, DbDeleteReply, DbQueryReply]
 class Db(StateMachine[Input, Output]):
-    def __init__(self):
-        self.db: Dict[str, Set[Record]] = dict()
+    """A relational database.
+
+    If persistent is true, every relation is backed by a persistent set, so
+    that snapshotting the database takes time linear in the number of
+    relations rather than in the number of records.
+    """
+    def __init__(self, persistent: bool = False):
+        self.persistent = persistent
+        self.db: Dict[str, MutableSet[Record]] = dict()
 
     def create(self, r: str, arity: int) -> DbCreateRequest:
         return DbCreateRequest(r, arity)
@@ -196,13 +281,28 @@ class Db(StateMachine[Input, Output]):
     def reset(self) -> None:
         self.db = dict()
 
+    # override.
+    def snapshot(self) -> Dict[str, MutableSet[Record]]:
+        return {r: copy.copy(ts) for (r, ts) in self.db.items()}
+
+    # override.
+    def restore(self, state: Dict[str, MutableSet[Record]]) -> None:
+        self.db = {r: copy.copy(ts) for (r, ts) in state.items()}
+
+    # override.
+    def footprint(self, i: Input) -> Set[str]:
+        if isinstance(i, DbQueryRequest):
+            return i.q.relations()
+        else:
+            return {i.r}
+
     # override.
     def transition(self, i: Input) -> Output:
         if isinstance(i, DbCreateRequest):
             if i.r in self.db:
                 return DbCreateReply(False)
             else:
-                self.db[i.r] = set()
+                self.db[i.r] = CowSet() if self.persistent else set()
                 return DbCreateReply(True)
         if isinstance(i, DbInsertRequest):
             if i.r not in self.db:
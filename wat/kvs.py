@@ -1,6 +1,9 @@
-from typing import Dict, NamedTuple, Optional, Union
+from typing import (Dict, List, MutableMapping, NamedTuple, Optional, Set,
+                    Union)
+import copy
 
-from .state_machine import StateMachine
+from .persistent import CowDict
+from .state_machine import StateMachine, mask_column
 
 class KvsGetRequest(NamedTuple):
     k: str
@@ -62,8 +65,20 @@ class KvsAddReply(NamedTuple):
 Input = Union[KvsGetRequest, KvsSetRequest]
 Output = Union[KvsGetReply, KvsSetReply]
 class Kvs(StateMachine[Input, Output]):
-    def __init__(self):
-        self.kvs: Dict[str, int] = dict()
+    """A key-value store.
+
+    If persistent is true, the store is backed by a persistent map, so that
+    snapshotting it takes O(1) time rather than O(n).
+    """
+    def __init__(self, persistent: bool = False):
+        self.persistent = persistent
+        self.kvs: MutableMapping[str, int] = self._empty()
+
+    def _empty(self) -> MutableMapping[str, int]:
+        if self.persistent:
+            return CowDict()
+        else:
+            return dict()
 
     def get(self, k: str) -> KvsGetRequest:
         return KvsGetRequest(k)
@@ -76,7 +91,59 @@ class Kvs(StateMachine[Input, Output]):
 
     # override.
     def reset(self) -> None:
-        self.kvs = dict()
+        self.kvs = self._empty()
+
+    # override.
+    def snapshot(self) -> MutableMapping[str, int]:
+        return copy.copy(self.kvs)
+
+    # override.
+    def restore(self, state: MutableMapping[str, int]) -> None:
+        self.kvs = copy.copy(state)
+
+    # override.
+    def footprint(self, i: Input) -> Set[str]:
+        return {i.k}
+
+    # override.
+    def run_batch(self, inputs: List[Input], masks: List[int], i: Input) \
+                  -> List[Output]:
+        # Only the value of i's key matters. values maps every value of the key
+        # to the masks in which the key has that value.
+        values: Dict[int, int] = dict()
+        for j, x in enumerate(inputs):
+            if x.k != i.k or isinstance(x, KvsGetRequest):
+                continue
+            column = mask_column(masks, j)
+            if isinstance(x, KvsSetRequest):
+                values = {v: c & ~column for (v, c) in values.items()}
+                values[x.v] = values.get(x.v, 0) | column
+            elif isinstance(x, KvsAddRequest):
+                added: Dict[int, int] = dict()
+                for v, c in values.items():
+                    added[v] = added.get(v, 0) | (c & ~column)
+                    added[v + x.x] = added.get(v + x.x, 0) | (c & column)
+                values = added
+            else:
+                raise ValueError(f'Unrecognized input "{x}".')
+
+        if isinstance(i, KvsGetRequest):
+            replies: List[Output] = [KvsGetReply(None)] * len(masks)
+            for v, c in values.items():
+                for b in range(len(masks)):
+                    if c >> b & 1:
+                        replies[b] = KvsGetReply(v)
+            return replies
+        elif isinstance(i, KvsSetRequest):
+            return [KvsSetReply()] * len(masks)
+        elif isinstance(i, KvsAddRequest):
+            present = 0
+            for c in values.values():
+                present |= c
+            return [KvsAddReply(bool(present >> b & 1))
+                    for b in range(len(masks))]
+        else:
+            raise ValueError(f'Unrecognized input "{i}".')
 
     # override.
     def transition(self, i: Input) -> Output:
@@ -1,5 +1,8 @@
-from typing import Dict, List, NamedTuple, Optional, Union
+from typing import (Dict, List, MutableSequence, NamedTuple, Optional,
+                    Union)
+import copy
 
+from .persistent import CowList
 from .state_machine import StateMachine
 
 class ListsLpushRequest(NamedTuple):
@@ -53,8 +56,20 @@ Output = Union[ListsLpushReply, ListsLpopReply, ListsRpushReply,
                ListsRpopReply, ListsRemoveReply, ListsSetReply, ListsSetReply,
                ListsIndexReply]
 class Lists(StateMachine[Input, Output]):
-    def __init__(self):
-        self.xs: List[str] = []
+    """A list.
+
+    If persistent is true, the list is backed by a persistent vector, so that
+    snapshotting it takes O(1) time rather than O(n).
+    """
+    def __init__(self, persistent: bool = False):
+        self.persistent = persistent
+        self.xs: MutableSequence[str] = self._empty()
+
+    def _empty(self) -> MutableSequence[str]:
+        if self.persistent:
+            return CowList()
+        else:
+            return []
 
     def lpush(self, x: str) -> ListsLpushRequest:
         return ListsLpushRequest(x)
@@ -79,12 +94,20 @@ class Lists(StateMachine[Input, Output]):
 
     # override.
     def reset(self) -> None:
-        self.xs = []
+        self.xs = self._empty()
+
+    # override.
+    def snapshot(self) -> MutableSequence[str]:
+        return copy.copy(self.xs)
+
+    # override.
+    def restore(self, state: MutableSequence[str]) -> None:
+        self.xs = copy.copy(state)
 
     # override.
     def transition(self, i: Input) -> Output:
         if isinstance(i, ListsLpushRequest):
-            self.xs = [i.x] + self.xs
+            self.xs.insert(0, i.x)
             return ListsLpushReply(True)
         elif isinstance(i, ListsLpopRequest):
             if len(self.xs) == 0:
@@ -0,0 +1,55 @@
+import importlib
+from typing import Callable, Dict, List
+
+from .bexpr import Bexpr
+from .db import Db
+from .kvs import Kvs
+from .lists import Lists
+from .state_machine import StateMachine
+
+# Tools that are given a state machine by name, like the provenance server,
+# look the name up in a registry of factories. A name of the form
+# "module:Class" can also name any StateMachine subclass, such as a WhiteBox
+# subclass, that can be constructed without arguments.
+_MACHINES: Dict[str, Callable[[], StateMachine]] = {
+    'Bexpr': Bexpr,
+    'Db': Db,
+    'Kvs': Kvs,
+    'Lists': Lists,
+}
+
+class UnknownMachineError(Exception):
+    pass
+
+def register_machine(name: str, factory: Callable[[], StateMachine]) -> None:
+    """Registers factory, which returns a fresh machine, under name."""
+    _MACHINES[name] = factory
+
+def machine_names() -> List[str]:
+    return sorted(_MACHINES)
+
+def make_machine(name: str, allow_import: bool = True) -> StateMachine:
+    """Returns a fresh machine of the registered or imported name.
+
+    Names of the form "module:Class" are imported only if allow_import is
+    True, since importing a module runs its code.
+    """
+    if name in _MACHINES:
+        return _MACHINES[name]()
+
+    if ':' not in name:
+        raise UnknownMachineError(f'Unknown machine "{name}". Known machines '
+                                  f'are {machine_names()}.')
+    if not allow_import:
+        raise UnknownMachineError(f'Refusing to import machine "{name}".')
+
+    module_name, qualname = name.split(':', 1)
+    try:
+        x = importlib.import_module(module_name)
+        for attribute in qualname.split('.'):
+            x = getattr(x, attribute)
+    except (ImportError, AttributeError) as e:
+        raise UnknownMachineError(f'Cannot import machine "{name}": {e}')
+    if not isinstance(x, type) or not issubclass(x, StateMachine):
+        raise UnknownMachineError(f'"{name}" is not a StateMachine.')
+    return x()
@@ -0,0 +1,534 @@
+from collections.abc import (Mapping, MutableMapping, MutableSequence,
+                             MutableSet, Set as AbstractSet)
+from typing import (Any, Generic, Hashable, Iterable, Iterator, List, Optional,
+                    Tuple, TypeVar, Union)
+
+# Persistent data structures are immutable, and every update returns a new
+# structure that shares all but O(log n) of its nodes with the old one. The
+# copy-on-write facades below wrap them in the usual mutable interfaces, so a
+# state machine can use them in place of dicts, sets, and lists, and copy its
+# state in O(1) to snapshot it.
+
+K = TypeVar('K')
+V = TypeVar('V')
+T = TypeVar('T')
+
+# PersistentMap ################################################################
+# A hash array mapped trie. Every node branches on the next 5 bits of a key's
+# hash, and its bitmap has a bit set for every branch that is present, so only
+# the present branches are stored. A leaf holds every key/value pair whose keys
+# share a hash.
+_BITS = 5
+_MASK = (1 << _BITS) - 1
+_HASH_BITS = 64
+
+class _Leaf:
+    __slots__ = ['hash', 'pairs']
+
+    def __init__(self, h: int, pairs: Tuple[Tuple[Any, Any], ...]) -> None:
+        self.hash = h
+        self.pairs = pairs
+
+class _Node:
+    __slots__ = ['bitmap', 'children']
+
+    def __init__(self, bitmap: int, children: Tuple[Any, ...]) -> None:
+        self.bitmap = bitmap
+        self.children = children
+
+_EMPTY_NODE = _Node(0, ())
+
+def _hash(key: Hashable) -> int:
+    return hash(key) & ((1 << _HASH_BITS) - 1)
+
+def _popcount(x: int) -> int:
+    return bin(x).count('1')
+
+def _branch(bitmap: int, bit: int) -> int:
+    return _popcount(bitmap & (bit - 1))
+
+def _merge(shift: int, a: _Leaf, b: _Leaf) -> _Node:
+    """Returns a node holding two leaves with different hashes."""
+    a_bit = 1 << ((a.hash >> shift) & _MASK)
+    b_bit = 1 << ((b.hash >> shift) & _MASK)
+    if a_bit == b_bit:
+        return _Node(a_bit, (_merge(shift + _BITS, a, b),))
+    elif a_bit < b_bit:
+        return _Node(a_bit | b_bit, (a, b))
+    else:
+        return _Node(a_bit | b_bit, (b, a))
+
+def _lookup(node: _Node, h: int, key: Any) -> Optional[Tuple[Any, Any]]:
+    shift = 0
+    while True:
+        bit = 1 << ((h >> shift) & _MASK)
+        if not node.bitmap & bit:
+            return None
+        child = node.children[_branch(node.bitmap, bit)]
+        if isinstance(child, _Leaf):
+            if child.hash != h:
+                return None
+            for pair in child.pairs:
+                if pair[0] == key:
+                    return pair
+            return None
+        node = child
+        shift += _BITS
+
+def _assoc(node: _Node, shift: int, h: int, key: Any, value: Any) \
+           -> Tuple[_Node, bool]:
+    """Returns node with key set to value and whether key was added."""
+    bit = 1 << ((h >> shift) & _MASK)
+    index = _branch(node.bitmap, bit)
+    children = node.children
+    if not node.bitmap & bit:
+        leaf = _Leaf(h, ((key, value),))
+        return (_Node(node.bitmap | bit,
+                      children[:index] + (leaf,) + children[index:]),
+                True)
+
+    child = children[index]
+    new_child: Union[_Leaf, _Node]
+    if isinstance(child, _Node):
+        new_child, added = _assoc(child, shift + _BITS, h, key, value)
+    elif child.hash != h:
+        new_child = _merge(shift + _BITS, child, _Leaf(h, ((key, value),)))
+        added = True
+    else:
+        pairs = tuple(pair for pair in child.pairs if pair[0] != key)
+        added = len(pairs) == len(child.pairs)
+        new_child = _Leaf(h, pairs + ((key, value),))
+    return (_Node(node.bitmap,
+                  children[:index] + (new_child,) + children[index + 1:]),
+            added)
+
+def _dissoc(node: _Node, shift: int, h: int, key: Any) -> Optional[_Node]:
+    """Returns node without key, or None if key is not in node."""
+    bit = 1 << ((h >> shift) & _MASK)
+    if not node.bitmap & bit:
+        return None
+    index = _branch(node.bitmap, bit)
+    children = node.children
+    child = children[index]
+    if isinstance(child, _Node):
+        new_child: Any = _dissoc(child, shift + _BITS, h, key)
+        if new_child is None:
+            return None
+        if new_child.bitmap == 0:
+            new_child = None
+        elif (len(new_child.children) == 1 and
+              isinstance(new_child.children[0], _Leaf)):
+            # Pull a lone leaf up, so that nodes only exist to branch.
+            new_child = new_child.children[0]
+    else:
+        if child.hash != h:
+            return None
+        pairs = tuple(pair for pair in child.pairs if pair[0] != key)
+        if len(pairs) == len(child.pairs):
+            return None
+        new_child = _Leaf(h, pairs) if len(pairs) > 0 else None
+
+    if new_child is None:
+        return _Node(node.bitmap & ~bit,
+                     children[:index] + children[index + 1:])
+    return _Node(node.bitmap,
+                 children[:index] + (new_child,) + children[index + 1:])
+
+def _pairs(node: _Node) -> Iterator[Tuple[Any, Any]]:
+    for child in node.children:
+        if isinstance(child, _Leaf):
+            yield from child.pairs
+        else:
+            yield from _pairs(child)
+
+class PersistentMap(Mapping, Generic[K, V]):
+    """An immutable map. set and delete return updated copies in O(log n)."""
+    def __init__(self, pairs: Iterable[Tuple[K, V]] = ()) -> None:
+        self._root = _EMPTY_NODE
+        self._size = 0
+        for k, v in pairs:
+            self._root, added = _assoc(self._root, 0, _hash(k), k, v)
+            self._size += added
+
+    @staticmethod
+    def _make(root: _Node, size: int) -> 'PersistentMap':
+        m: PersistentMap = PersistentMap.__new__(PersistentMap)
+        m._root = root
+        m._size = size
+        return m
+
+    def __getitem__(self, k: K) -> V:
+        pair = _lookup(self._root, _hash(k), k)
+        if pair is None:
+            raise KeyError(k)
+        return pair[1]
+
+    def __contains__(self, k: Any) -> bool:
+        return _lookup(self._root, _hash(k), k) is not None
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self) -> Iterator[K]:
+        for k, _ in _pairs(self._root):
+            yield k
+
+    def items(self) -> Iterator[Tuple[K, V]]: # type: ignore
+        return _pairs(self._root)
+
+    def set(self, k: K, v: V) -> 'PersistentMap[K, V]':
+        root, added = _assoc(self._root, 0, _hash(k), k, v)
+        return PersistentMap._make(root, self._size + added)
+
+    def delete(self, k: K) -> 'PersistentMap[K, V]':
+        root = _dissoc(self._root, 0, _hash(k), k)
+        if root is None:
+            raise KeyError(k)
+        return PersistentMap._make(root, self._size - 1)
+
+    def __str__(self) -> str:
+        return f'PersistentMap({dict(self.items())})'
+
+    def __repr__(self) -> str:
+        return str(self)
+
+class PersistentSet(AbstractSet, Generic[T]):
+    """An immutable set. add and discard return updated copies in O(log n).
+
+    The set operations inherited from Set, like | and -, return plain sets.
+    """
+    def __init__(self, xs: Iterable[T] = ()) -> None:
+        self._map: PersistentMap[T, None] = \
+            PersistentMap((x, None) for x in xs)
+
+    @staticmethod
+    def _make(m: PersistentMap) -> 'PersistentSet':
+        s: PersistentSet = PersistentSet.__new__(PersistentSet)
+        s._map = m
+        return s
+
+    @classmethod
+    def _from_iterable(cls, xs: Iterable[Any]) -> set:
+        return set(xs)
+
+    def __contains__(self, x: Any) -> bool:
+        return x in self._map
+
+    def __len__(self) -> int:
+        return len(self._map)
+
+    def __iter__(self) -> Iterator[T]:
+        return iter(self._map)
+
+    def add(self, x: T) -> 'PersistentSet[T]':
+        if x in self._map:
+            return self
+        return PersistentSet._make(self._map.set(x, None))
+
+    def discard(self, x: T) -> 'PersistentSet[T]':
+        if x not in self._map:
+            return self
+        return PersistentSet._make(self._map.delete(x))
+
+    def __str__(self) -> str:
+        return f'PersistentSet({set(self)})'
+
+    def __repr__(self) -> str:
+        return str(self)
+
+# PersistentVector #############################################################
+# An AVL tree keyed implicitly by position: every node stores the size of its
+# subtree, and the kth element is found by comparing k to the size of the left
+# subtree. Inserting or deleting at any position takes O(log n).
+class _VectorNode:
+    __slots__ = ['value', 'left', 'right', 'size', 'height']
+
+    def __init__(self,
+                 value: Any,
+                 left: Optional['_VectorNode'],
+                 right: Optional['_VectorNode']) -> None:
+        self.value = value
+        self.left = left
+        self.right = right
+        self.size = _size(left) + _size(right) + 1
+        self.height = max(_height(left), _height(right)) + 1
+
+def _size(node: Optional[_VectorNode]) -> int:
+    return 0 if node is None else node.size
+
+def _height(node: Optional[_VectorNode]) -> int:
+    return 0 if node is None else node.height
+
+def _balance(value: Any,
+             left: Optional[_VectorNode],
+             right: Optional[_VectorNode]) \
+             -> _VectorNode:
+    if _height(left) > _height(right) + 1:
+        assert left is not None
+        if _height(left.left) >= _height(left.right):
+            return _VectorNode(left.value, left.left,
+                               _VectorNode(value, left.right, right))
+        assert left.right is not None
+        return _VectorNode(left.right.value,
+                           _VectorNode(left.value, left.left,
+                                       left.right.left),
+                           _VectorNode(value, left.right.right, right))
+    if _height(right) > _height(left) + 1:
+        assert right is not None
+        if _height(right.right) >= _height(right.left):
+            return _VectorNode(right.value,
+                               _VectorNode(value, left, right.left),
+                               right.right)
+        assert right.left is not None
+        return _VectorNode(right.left.value,
+                           _VectorNode(value, left, right.left.left),
+                           _VectorNode(right.value, right.left.right,
+                                       right.right))
+    return _VectorNode(value, left, right)
+
+def _build(xs: List[Any], start: int, stop: int) -> Optional[_VectorNode]:
+    if start >= stop:
+        return None
+    middle = (start + stop) // 2
+    return _VectorNode(xs[middle], _build(xs, start, middle),
+                       _build(xs, middle + 1, stop))
+
+def _get(node: Optional[_VectorNode], k: int) -> _VectorNode:
+    while node is not None:
+        left = _size(node.left)
+        if k < left:
+            node = node.left
+        elif k == left:
+            return node
+        else:
+            k -= left + 1
+            node = node.right
+    raise IndexError(k)
+
+def _insert(node: Optional[_VectorNode], k: int, x: Any) -> _VectorNode:
+    if node is None:
+        return _VectorNode(x, None, None)
+    left = _size(node.left)
+    if k <= left:
+        return _balance(node.value, _insert(node.left, k, x), node.right)
+    else:
+        return _balance(node.value, node.left,
+                        _insert(node.right, k - left - 1, x))
+
+def _set(node: Optional[_VectorNode], k: int, x: Any) -> _VectorNode:
+    assert node is not None
+    left = _size(node.left)
+    if k < left:
+        return _VectorNode(node.value, _set(node.left, k, x), node.right)
+    elif k == left:
+        return _VectorNode(x, node.left, node.right)
+    else:
+        return _VectorNode(node.value, node.left,
+                           _set(node.right, k - left - 1, x))
+
+def _delete_first(node: _VectorNode) -> Tuple[Optional[_VectorNode], Any]:
+    if node.left is None:
+        return (node.right, node.value)
+    left, value = _delete_first(node.left)
+    return (_balance(node.value, left, node.right), value)
+
+def _delete(node: Optional[_VectorNode], k: int) -> Optional[_VectorNode]:
+    assert node is not None
+    left = _size(node.left)
+    if k < left:
+        return _balance(node.value, _delete(node.left, k), node.right)
+    elif k > left:
+        return _balance(node.value, node.left,
+                        _delete(node.right, k - left - 1))
+    elif node.right is None:
+        return node.left
+    else:
+        right, value = _delete_first(node.right)
+        return _balance(value, node.left, right)
+
+def _values(node: Optional[_VectorNode]) -> Iterator[Any]:
+    stack: List[_VectorNode] = []
+    while node is not None or len(stack) > 0:
+        while node is not None:
+            stack.append(node)
+            node = node.left
+        node = stack.pop()
+        yield node.value
+        node = node.right
+
+class PersistentVector(Generic[T]):
+    """An immutable sequence. Updates return copies in O(log n)."""
+    def __init__(self, xs: Iterable[T] = ()) -> None:
+        values = list(xs)
+        self._root = _build(values, 0, len(values))
+
+    @staticmethod
+    def _make(root: Optional[_VectorNode]) -> 'PersistentVector':
+        v: PersistentVector = PersistentVector.__new__(PersistentVector)
+        v._root = root
+        return v
+
+    def _index(self, k: int) -> int:
+        if k < 0:
+            k += len(self)
+        if not 0 <= k < len(self):
+            raise IndexError(k)
+        return k
+
+    def __len__(self) -> int:
+        return _size(self._root)
+
+    def __getitem__(self, k: int) -> T:
+        return _get(self._root, self._index(k)).value
+
+    def __iter__(self) -> Iterator[T]:
+        return _values(self._root)
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, (PersistentVector, list)):
+            return NotImplemented
+        return len(self) == len(other) and list(self) == list(other)
+
+    def set(self, k: int, x: T) -> 'PersistentVector[T]':
+        return PersistentVector._make(_set(self._root, self._index(k), x))
+
+    def insert(self, k: int, x: T) -> 'PersistentVector[T]':
+        k = max(0, min(len(self), k + len(self) if k < 0 else k))
+        return PersistentVector._make(_insert(self._root, k, x))
+
+    def append(self, x: T) -> 'PersistentVector[T]':
+        return self.insert(len(self), x)
+
+    def delete(self, k: int) -> 'PersistentVector[T]':
+        return PersistentVector._make(_delete(self._root, self._index(k)))
+
+    def __str__(self) -> str:
+        return f'PersistentVector({list(self)})'
+
+    def __repr__(self) -> str:
+        return str(self)
+
+# Copy-on-write facades ########################################################
+class CowDict(MutableMapping, Generic[K, V]):
+    """A mutable dict backed by a PersistentMap, with an O(1) copy."""
+    def __init__(self, pairs: Iterable[Tuple[K, V]] = ()) -> None:
+        self._map: PersistentMap[K, V] = PersistentMap(pairs)
+
+    def __copy__(self) -> 'CowDict[K, V]':
+        return self.copy()
+
+    def copy(self) -> 'CowDict[K, V]':
+        d: CowDict[K, V] = CowDict()
+        d._map = self._map
+        return d
+
+    def __getitem__(self, k: K) -> V:
+        return self._map[k]
+
+    def __setitem__(self, k: K, v: V) -> None:
+        self._map = self._map.set(k, v)
+
+    def __delitem__(self, k: K) -> None:
+        self._map = self._map.delete(k)
+
+    def __contains__(self, k: Any) -> bool:
+        return k in self._map
+
+    def __len__(self) -> int:
+        return len(self._map)
+
+    def __iter__(self) -> Iterator[K]:
+        return iter(self._map)
+
+    def __str__(self) -> str:
+        return str(dict(self._map.items()))
+
+    def __repr__(self) -> str:
+        return str(self)
+
+class CowSet(MutableSet, Generic[T]):
+    """A mutable set backed by a PersistentSet, with an O(1) copy.
+
+    The set operations inherited from Set, like | and -, return plain sets.
+    """
+    def __init__(self, xs: Iterable[T] = ()) -> None:
+        self._set: PersistentSet[T] = PersistentSet(xs)
+
+    @classmethod
+    def _from_iterable(cls, xs: Iterable[Any]) -> set:
+        return set(xs)
+
+    def __copy__(self) -> 'CowSet[T]':
+        return self.copy()
+
+    def copy(self) -> 'CowSet[T]':
+        s: CowSet[T] = CowSet()
+        s._set = self._set
+        return s
+
+    def add(self, x: T) -> None:
+        self._set = self._set.add(x)
+
+    def discard(self, x: T) -> None:
+        self._set = self._set.discard(x)
+
+    def __contains__(self, x: Any) -> bool:
+        return x in self._set
+
+    def __len__(self) -> int:
+        return len(self._set)
+
+    def __iter__(self) -> Iterator[T]:
+        return iter(self._set)
+
+    def __str__(self) -> str:
+        return str(set(self._set))
+
+    def __repr__(self) -> str:
+        return str(self)
+
+class CowList(MutableSequence, Generic[T]):
+    """A mutable list backed by a PersistentVector, with an O(1) copy.
+
+    Unlike a list, inserting or deleting anywhere takes O(log n), but indexing
+    takes O(log n) too, and CowLists cannot be sliced.
+    """
+    def __init__(self, xs: Iterable[T] = ()) -> None:
+        self._vector: PersistentVector[T] = PersistentVector(xs)
+
+    def __copy__(self) -> 'CowList[T]':
+        return self.copy()
+
+    def copy(self) -> 'CowList[T]':
+        xs: CowList[T] = CowList()
+        xs._vector = self._vector
+        return xs
+
+    def __getitem__(self, k: int) -> T: # type: ignore
+        return self._vector[k]
+
+    def __setitem__(self, k: int, x: T) -> None: # type: ignore
+        self._vector = self._vector.set(k, x)
+
+    def __delitem__(self, k: int) -> None: # type: ignore
+        self._vector = self._vector.delete(k)
+
+    def insert(self, k: int, x: T) -> None:
+        self._vector = self._vector.insert(k, x)
+
+    def __len__(self) -> int:
+        return len(self._vector)
+
+    def __iter__(self) -> Iterator[T]:
+        return iter(self._vector)
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, CowList):
+            return self._vector == other._vector
+        return self._vector == other
+
+    def __str__(self) -> str:
+        return str(list(self._vector))
+
+    def __repr__(self) -> str:
+        return str(self)
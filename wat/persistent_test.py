@@ -0,0 +1,232 @@
+from typing import Any, Dict, List, Optional
+import random
+import unittest
+
+from .persistent import (CowDict, CowList, CowSet, PersistentMap,
+                         PersistentSet, PersistentVector, _VectorNode)
+
+class Key:
+    """A key whose hash is chosen, so that keys can be made to collide."""
+    def __init__(self, x: int, h: int) -> None:
+        self.x = x
+        self.h = h
+
+    def __hash__(self) -> int:
+        return self.h
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, Key) and self.x == other.x
+
+    def __repr__(self) -> str:
+        return f'Key({self.x}, {self.h})'
+
+def make_key(x: int) -> Key:
+    # Every hash is shared by four keys, and distinct hashes differ only in
+    # their lowest and highest bits, so leaves hold several pairs and nodes
+    # nest deeply.
+    return Key(x, (x % 4) | ((x // 16) << 55))
+
+def random_key(rand: random.Random) -> Key:
+    return make_key(rand.randrange(64))
+
+def check_vector(node: Optional[_VectorNode]) -> int:
+    """Checks that node is a balanced tree with correct sizes."""
+    if node is None:
+        return 0
+    left = check_vector(node.left)
+    right = check_vector(node.right)
+    assert abs(left - right) <= 1, (left, right)
+    assert node.height == max(left, right) + 1
+    left_size = 0 if node.left is None else node.left.size
+    right_size = 0 if node.right is None else node.right.size
+    assert node.size == left_size + right_size + 1
+    return node.height
+
+class PersistentMapTest(unittest.TestCase):
+    def test_random_operations(self) -> None:
+        rand = random.Random(0)
+        for _ in range(20):
+            m: PersistentMap[Key, int] = PersistentMap()
+            expected: Dict[Key, int] = dict()
+            versions = [(m, dict(expected))]
+            for _ in range(200):
+                k = random_key(rand)
+                if rand.random() < 0.6:
+                    v = rand.randrange(1000)
+                    m = m.set(k, v)
+                    expected[k] = v
+                elif k in expected:
+                    m = m.delete(k)
+                    del expected[k]
+                else:
+                    with self.assertRaises(KeyError):
+                        m.delete(k)
+                self.assertEqual(len(m), len(expected))
+                self.assertEqual(dict(m.items()), expected)
+                versions.append((m, dict(expected)))
+
+            for version, contents in versions:
+                self.assertEqual(dict(version.items()), contents)
+                for x in range(64):
+                    k = make_key(x)
+                    self.assertEqual(k in version, k in contents)
+                    self.assertEqual(version.get(k), contents.get(k))
+
+class PersistentSetTest(unittest.TestCase):
+    def test_random_operations(self) -> None:
+        rand = random.Random(1)
+        for _ in range(20):
+            s: PersistentSet[Key] = PersistentSet()
+            expected: set = set()
+            versions = [(s, set(expected))]
+            for _ in range(200):
+                k = random_key(rand)
+                if rand.random() < 0.6:
+                    s = s.add(k)
+                    expected.add(k)
+                else:
+                    s = s.discard(k)
+                    expected.discard(k)
+                self.assertEqual(len(s), len(expected))
+                self.assertEqual(set(s), expected)
+                versions.append((s, set(expected)))
+
+            for version, contents in versions:
+                self.assertEqual(set(version), contents)
+                self.assertEqual(version, contents)
+                self.assertEqual(version | {Key(-1, 0)},
+                                 contents | {Key(-1, 0)})
+
+class PersistentVectorTest(unittest.TestCase):
+    def test_random_operations(self) -> None:
+        rand = random.Random(2)
+        for _ in range(20):
+            expected = list(range(rand.randrange(8)))
+            v: PersistentVector[int] = PersistentVector(expected)
+            versions = [(v, list(expected))]
+            for _ in range(200):
+                x = rand.randrange(1000)
+                op = rand.randrange(4)
+                if op == 0:
+                    k = rand.randrange(-len(expected) - 2, len(expected) + 3)
+                    v = v.insert(k, x)
+                    expected.insert(k, x)
+                elif op == 1:
+                    v = v.append(x)
+                    expected.append(x)
+                elif len(expected) == 0:
+                    with self.assertRaises(IndexError):
+                        v.delete(0)
+                elif op == 2:
+                    k = rand.randrange(-len(expected), len(expected))
+                    v = v.delete(k)
+                    del expected[k]
+                else:
+                    k = rand.randrange(-len(expected), len(expected))
+                    v = v.set(k, x)
+                    expected[k] = x
+                self.assertEqual(list(v), expected)
+                check_vector(v._root)
+                versions.append((v, list(expected)))
+
+            for version, contents in versions:
+                self.assertEqual(version, contents)
+                self.assertEqual(len(version), len(contents))
+                for k in range(-len(contents), len(contents)):
+                    self.assertEqual(version[k], contents[k])
+                with self.assertRaises(IndexError):
+                    version[len(contents)]
+
+class CowTest(unittest.TestCase):
+    def test_cow_dict(self) -> None:
+        rand = random.Random(3)
+        d: CowDict[Key, int] = CowDict()
+        expected: Dict[Key, int] = dict()
+        copies = [(d.copy(), dict(expected))]
+        for _ in range(1000):
+            k = random_key(rand)
+            if rand.random() < 0.6:
+                d[k] = rand.randrange(1000)
+                expected[k] = d[k]
+            elif k in expected:
+                del d[k]
+                del expected[k]
+            else:
+                with self.assertRaises(KeyError):
+                    del d[k]
+            self.assertEqual(dict(d), expected)
+            copies.append((d.copy(), dict(expected)))
+
+        for copy, contents in copies:
+            self.assertEqual(dict(copy), contents)
+            self.assertEqual(len(copy), len(contents))
+
+    def test_cow_set(self) -> None:
+        rand = random.Random(4)
+        s: CowSet[Key] = CowSet()
+        expected: set = set()
+        copies = [(s.copy(), set(expected))]
+        for _ in range(1000):
+            k = random_key(rand)
+            op = rand.randrange(3)
+            if op == 0:
+                s.add(k)
+                expected.add(k)
+            elif op == 1:
+                s.discard(k)
+                expected.discard(k)
+            elif k in expected:
+                s.remove(k)
+                expected.remove(k)
+            else:
+                with self.assertRaises(KeyError):
+                    s.remove(k)
+            self.assertEqual(s, expected)
+            copies.append((s.copy(), set(expected)))
+
+        for copy, contents in copies:
+            self.assertEqual(set(copy), contents)
+            self.assertEqual(copy - {Key(0, 0)}, contents - {Key(0, 0)})
+
+    def test_cow_list(self) -> None:
+        rand = random.Random(5)
+        xs: CowList[int] = CowList()
+        expected: List[int] = []
+        copies = [(xs.copy(), list(expected))]
+        for _ in range(1000):
+            x = rand.randrange(10)
+            op = rand.randrange(6)
+            if op == 0:
+                k = rand.randrange(-len(expected) - 2, len(expected) + 3)
+                xs.insert(k, x)
+                expected.insert(k, x)
+            elif op == 1:
+                xs.append(x)
+                expected.append(x)
+            elif len(expected) == 0:
+                with self.assertRaises(IndexError):
+                    xs.pop()
+            elif op == 2:
+                k = rand.randrange(-len(expected), len(expected))
+                self.assertEqual(xs.pop(k), expected.pop(k))
+            elif op == 3:
+                k = rand.randrange(-len(expected), len(expected))
+                xs[k] = x
+                expected[k] = x
+            elif op == 4:
+                k = rand.randrange(-len(expected), len(expected))
+                del xs[k]
+                del expected[k]
+            elif x in expected:
+                xs.remove(x)
+                expected.remove(x)
+            self.assertEqual(list(xs), expected)
+            self.assertEqual(x in xs, x in expected)
+            copies.append((xs.copy(), list(expected)))
+
+        for copy, contents in copies:
+            self.assertEqual(copy, contents)
+            self.assertEqual(len(copy), len(contents))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+import hashlib
+import json
+import sqlite3
+import sys
+import types
+from typing import Any, List, Optional, Set
+
+from .state_machine import StateMachine
+
+def _serialize(x: Any, out: List[str], active: Set[int]) -> None:
+    """Appends a serialization of x to out that is stable across processes.
+
+    Unlike hash and repr, the serialization does not depend on the hash seed,
+    on set iteration order, or on memory addresses. Functions are serialized
+    by their name and code, and other objects by their class and attributes.
+    """
+    if x is None or isinstance(x, (bool, int, float, str, bytes)):
+        out.append(f'{type(x).__name__}:{x!r}')
+    elif isinstance(x, tuple) and hasattr(x, '_fields'):
+        out.append(f'namedtuple:{type(x).__module__}.{type(x).__qualname__}(')
+        for y in x:
+            _serialize(y, out, active)
+        out.append(')')
+    elif isinstance(x, (tuple, list)):
+        out.append(f'{type(x).__name__}(')
+        for y in x:
+            _serialize(y, out, active)
+        out.append(')')
+    elif isinstance(x, (set, frozenset)):
+        out.append(f'{type(x).__name__}(')
+        out += sorted(_serialization(y, active) for y in x)
+        out.append(')')
+    elif isinstance(x, dict):
+        out.append('dict(')
+        out += sorted(_serialization(k, active) + _serialization(v, active)
+                      for (k, v) in x.items())
+        out.append(')')
+    elif isinstance(x, types.CodeType):
+        out.append(f'code:{x.co_name}:{x.co_code.hex()}:{x.co_names}(')
+        for const in x.co_consts:
+            _serialize(const, out, active)
+        out.append(')')
+    elif isinstance(x, types.FunctionType):
+        out.append(f'function:{x.__module__}.{x.__qualname__}(')
+        _serialize(x.__code__, out, active)
+        _serialize(x.__defaults__, out, active)
+        cells = x.__closure__ or ()
+        _serialize([cell.cell_contents for cell in cells], out, active)
+        out.append(')')
+    elif isinstance(x, type):
+        out.append(f'type:{x.__module__}.{x.__qualname__}')
+    else:
+        if id(x) in active:
+            raise ValueError(f'Cannot serialize cyclic object "{x}".')
+        if not hasattr(x, '__dict__'):
+            raise ValueError(f'Cannot serialize "{x}".')
+        active.add(id(x))
+        out.append(f'object:{type(x).__module__}.{type(x).__qualname__}(')
+        _serialize(vars(x), out, active)
+        out.append(')')
+        active.remove(id(x))
+
+def _serialization(x: Any, active: Set[int]) -> str:
+    out: List[str] = []
+    _serialize(x, out, active)
+    return ''.join(out)
+
+def stable_hash(x: Any) -> str:
+    """Returns a hash of x that is the same in every process."""
+    serialization = _serialization(x, set())
+    return hashlib.sha256(serialization.encode('utf-8')).hexdigest()
+
+def machine_fingerprint(m: StateMachine) -> Any:
+    """Returns what determines how m behaves.
+
+    A machine is determined by the code of its class and its configuration.
+    The code is included so that cached results are not reused once the
+    machine changes.
+    """
+    code = [(klass.__qualname__, name, value)
+            for klass in type(m).__mro__
+            if klass.__module__ not in ('builtins', 'typing')
+            for (name, value) in sorted(vars(klass).items())
+            if isinstance(value, types.FunctionType)]
+    return (type(m), code, m.configuration(), sys.version_info[:2])
+
+class ResultCache:
+    """A persistent cache of wat results, stored in a sqlite database at path.
+
+    Results are keyed by a stable hash of the state machine (see
+    machine_fingerprint), the trace up to and including the queried output,
+    and the index of the output, so a cache can be shared by every process
+    that queries the same traces. Only the indexes of the witnesses' inputs
+    are stored. Once the cache holds max_size results, the least recently
+    used results are evicted. hits and misses count the lookups of this
+    ResultCache that did and did not find a result.
+    """
+    def __init__(self, path: str, max_size: int = 2**16) -> None:
+        assert max_size > 0, max_size
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS results ('
+                        '  key TEXT PRIMARY KEY,'
+                        '  witnesses TEXT NOT NULL,'
+                        '  last_used INTEGER NOT NULL'
+                        ')')
+        self.db.execute('CREATE INDEX IF NOT EXISTS results_last_used '
+                        'ON results (last_used)')
+        self.db.commit()
+
+    def __str__(self) -> str:
+        return (f'ResultCache(path={self.path}, size={len(self)}, '
+                f'hits={self.hits}, misses={self.misses})')
+
+    def __repr__(self) -> str:
+        return str(self)
+
+    def __len__(self) -> int:
+        return self.db.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def close(self) -> None:
+        self.db.close()
+
+    def key(self, m: StateMachine, trace: List[Any], j: int) -> str:
+        return stable_hash((machine_fingerprint(m), trace[:j + 1], j))
+
+    def _touch(self, key: str) -> None:
+        self.db.execute('UPDATE results '
+                        'SET last_used = (SELECT MAX(last_used) + 1 '
+                        '                 FROM results) '
+                        'WHERE key = ?', (key,))
+
+    def get(self, m: StateMachine, trace: List[Any], j: int) \
+            -> Optional[List[List[int]]]:
+        """Returns the indexes of the witnesses of the jth output of trace."""
+        key = self.key(m, trace, j)
+        row = self.db.execute('SELECT witnesses FROM results WHERE key = ?',
+                              (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._touch(key)
+        self.db.commit()
+        return json.loads(row[0])
+
+    def put(self,
+            m: StateMachine,
+            trace: List[Any],
+            j: int,
+            witnesses: List[List[int]]) \
+            -> None:
+        key = self.key(m, trace, j)
+        self.db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, '
+                        '  (SELECT COALESCE(MAX(last_used), 0) + 1 '
+                        '   FROM results))',
+                        (key, json.dumps(witnesses)))
+        self.db.execute('DELETE FROM results WHERE key IN ('
+                        '  SELECT key FROM results'
+                        '  ORDER BY last_used DESC'
+                        '  LIMIT -1 OFFSET ?'
+                        ')', (self.max_size,))
+        self.db.commit()
@@ -0,0 +1,328 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from .machines import make_machine
+from .stats import WatStats
+from .trace_file import TraceReader
+from .wat import _filter_happens_before, _indexes, _lexicographic_key, iter_wat
+
+# A provenance server answers wat queries over trace files for many clients.
+# Clients connect to a Unix socket or a localhost TCP port and exchange JSON
+# objects, one per line. A client starts a query with
+#
+#   {"op": "wat", "id": 1, "machine": "Kvs", "trace": "kvs.trace", "j": 7}
+#
+# where machine is a name known to make_machine, trace is the path of a trace
+# file (see trace_file.py), and j is the index of the queried output. id is
+# chosen by the client and tags every reply to the query:
+#
+#   {"id": 1, "event": "started"}
+#   {"id": 1, "event": "witness", "witness": [0, 3]}
+#   {"id": 1, "event": "done", "witnesses": [[0, 3]], "stats": {...}}
+#
+# Every witness is streamed as soon as it is found, as the indexes of its
+# inputs. The done event then lists the wat provenance, which leaves out the
+# streamed witnesses that happen before another (see iter_wat). A query that
+# fails ends with {"id": 1, "event": "error", "message": "..."} instead.
+#
+# A client cancels a query with {"op": "cancel", "id": 1}, which is answered
+# with {"id": 1, "event": "cancelled"}. Queries of the same machine, trace
+# file, and j are merged into a single job, which streams its events to every
+# client that asked for it, and the job is only stopped once every one of its
+# queries is cancelled or its client disconnects.
+#
+# Jobs are queued and run in worker processes, at most workers at a time. A
+# job gets a fresh process, so cancelling a running job terminates it. Workers
+# are started by a fork server rather than forked from the server, so that
+# they do not inherit, and hold open, the sockets of the server's clients.
+
+def _work(machine: str,
+          path: str,
+          j: int,
+          allow_import: bool,
+          trusted_packages: Tuple[str, ...],
+          conn: Any) \
+          -> None:
+    """Runs a query in a worker process, sending its events to conn."""
+    try:
+        m = make_machine(machine, allow_import)
+        with TraceReader(path, trusted_packages) as reader:
+            if not 0 <= j < len(reader):
+                raise IndexError(f'j={j} is out of range for a trace of '
+                                 f'length {len(reader)}.')
+            trace = reader[:j + 1]
+
+        stats = WatStats()
+        witnesses: List[int] = []
+        for witness in iter_wat(m, trace, j, stats=stats):
+            indexes = [k for (k, _, _) in witness]
+            witnesses.append(sum(1 << k for k in indexes))
+            conn.send(('witness', indexes))
+        witnesses.sort(key=_lexicographic_key)
+        witnesses = _filter_happens_before(witnesses)
+        conn.send(('done', [_indexes(w) for w in witnesses], stats.as_dict()))
+    except Exception as e:
+        conn.send(('error', f'{type(e).__name__}: {e}'))
+    finally:
+        conn.close()
+
+class _Connection:
+    def __init__(self, writer: asyncio.StreamWriter) -> None:
+        self.writer = writer
+        self.jobs: Dict[Any, _Job] = dict()
+        self.closed = asyncio.Event()
+
+    def send(self, message: Dict[str, Any]) -> None:
+        if not self.writer.transport.is_closing():
+            self.writer.write((json.dumps(message) + '\n').encode('utf-8'))
+
+class _Job:
+    def __init__(self, key: Hashable, machine: str, path: str, j: int) -> None:
+        self.key = key
+        self.machine = machine
+        self.path = path
+        self.j = j
+        self.events: List[Dict[str, Any]] = []
+        self.subscribers: List[Tuple[_Connection, Any]] = []
+        self.task: Optional[asyncio.Future] = None
+
+    def publish(self, event: Dict[str, Any]) -> None:
+        """Sends event to every subscriber, and to later subscribers too."""
+        self.events.append(event)
+        for connection, request_id in self.subscribers:
+            connection.send(dict(event, id=request_id))
+
+class WatServer:
+    """A server that runs wat queries on at most workers processes at once.
+
+    allow_import and trusted_packages are passed to make_machine and
+    TraceReader, so by default only the registered machines, and traces of
+    classes in the wat package, can be queried.
+    """
+    def __init__(self,
+                 workers: int = 1,
+                 allow_import: bool = False,
+                 trusted_packages: Tuple[str, ...] = ('wat',)) -> None:
+        assert workers >= 1, workers
+        self.workers = workers
+        self.allow_import = allow_import
+        self.trusted_packages = trusted_packages
+        self.jobs: Dict[Hashable, _Job] = dict()
+        self.connections: List[_Connection] = []
+        self.slots: Optional[asyncio.Semaphore] = None
+        self.context = multiprocessing.get_context('forkserver')
+        self.context.set_forkserver_preload(['wat'])
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self,
+                    path: Optional[str] = None,
+                    port: Optional[int] = None) \
+                    -> None:
+        """Listens on the Unix socket at path or on localhost's port."""
+        assert (path is None) != (port is None), (path, port)
+        self.slots = asyncio.Semaphore(self.workers)
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self._handle, path)
+        else:
+            self.server = await asyncio.start_server(self._handle,
+                                                     '127.0.0.1', port)
+
+    async def close(self) -> None:
+        """Stops listening, disconnects every client, and cancels every job."""
+        if self.server is not None:
+            self.server.close()
+        connections = list(self.connections)
+        for connection in connections:
+            connection.writer.close()
+        await asyncio.gather(*(c.closed.wait() for c in connections))
+        if self.server is not None:
+            await self.server.wait_closed()
+        tasks = [job.task for job in self.jobs.values() if job.task is not None]
+        self.jobs = dict()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _handle(self,
+                      reader: asyncio.StreamReader,
+                      writer: asyncio.StreamWriter) \
+                      -> None:
+        connection = _Connection(writer)
+        self.connections.append(connection)
+        try:
+            while True:
+                line = await reader.readline()
+                if len(line) == 0:
+                    break
+                self._dispatch(connection, line)
+        finally:
+            for request_id in list(connection.jobs):
+                self._unsubscribe(connection, request_id)
+            self.connections.remove(connection)
+            writer.close()
+            connection.closed.set()
+
+    def _dispatch(self, connection: _Connection, line: bytes) -> None:
+        request_id = None
+        try:
+            request = json.loads(line.decode('utf-8'))
+            if not isinstance(request, dict):
+                raise ValueError('A request must be a JSON object.')
+            request_id = request.get('id')
+            op = request.get('op')
+            if op == 'wat':
+                self._subscribe(connection, request_id, request['machine'],
+                                request['trace'], request['j'])
+            elif op == 'cancel':
+                if request_id not in connection.jobs:
+                    raise ValueError(f'No query has id {request_id}.')
+                self._unsubscribe(connection, request_id)
+                connection.send({'id': request_id, 'event': 'cancelled'})
+            else:
+                raise ValueError(f'Unrecognized op "{op}".')
+        except (ValueError, KeyError, TypeError, OSError) as e:
+            connection.send({'id': request_id,
+                             'event': 'error',
+                             'message': f'{type(e).__name__}: {e}'})
+
+    def _subscribe(self,
+                   connection: _Connection,
+                   request_id: Any,
+                   machine: str,
+                   path: str,
+                   j: int) \
+                   -> None:
+        if request_id in connection.jobs:
+            raise ValueError(f'A query with id {request_id} is running.')
+        if not isinstance(machine, str) or not isinstance(path, str):
+            raise TypeError('machine and trace must be strings.')
+        if not isinstance(j, int):
+            raise TypeError('j must be an integer.')
+
+        # Queries are merged if they read the same version of the same file.
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        key = (machine, path, stat.st_mtime_ns, stat.st_size, j)
+        job = self.jobs.get(key)
+        if job is None:
+            job = _Job(key, machine, path, j)
+            self.jobs[key] = job
+            job.task = asyncio.ensure_future(self._run(job))
+
+        connection.jobs[request_id] = job
+        job.subscribers.append((connection, request_id))
+        for event in job.events:
+            connection.send(dict(event, id=request_id))
+
+    def _unsubscribe(self, connection: _Connection, request_id: Any) -> None:
+        job = connection.jobs.pop(request_id)
+        job.subscribers.remove((connection, request_id))
+        if len(job.subscribers) == 0 and self.jobs.get(job.key) is job:
+            del self.jobs[job.key]
+            assert job.task is not None
+            job.task.cancel()
+
+    def _finish(self, job: _Job, event: Dict[str, Any]) -> None:
+        job.publish(event)
+        for connection, request_id in job.subscribers:
+            del connection.jobs[request_id]
+        job.subscribers = []
+        if self.jobs.get(job.key) is job:
+            del self.jobs[job.key]
+
+    async def _run(self, job: _Job) -> None:
+        try:
+            await self._run_worker(job)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._finish(job, {'event': 'error',
+                               'message': f'{type(e).__name__}: {e}'})
+
+    async def _run_worker(self, job: _Job) -> None:
+        assert self.slots is not None
+        async with self.slots:
+            job.publish({'event': 'started'})
+            loop = asyncio.get_event_loop()
+            receiver, sender = self.context.Pipe(duplex=False)
+            process = self.context.Process(
+                target=_work,
+                args=(job.machine, job.path, job.j, self.allow_import,
+                      self.trusted_packages, sender),
+                daemon=True)
+            process.start()
+            sender.close()
+
+            # The worker's messages are queued as soon as the pipe is
+            # readable, and None is queued once the worker closes it.
+            messages: asyncio.Queue = asyncio.Queue()
+
+            def readable() -> None:
+                try:
+                    messages.put_nowait(receiver.recv())
+                except EOFError:
+                    loop.remove_reader(receiver.fileno())
+                    messages.put_nowait(None)
+            loop.add_reader(receiver.fileno(), readable)
+
+            try:
+                while True:
+                    message = await messages.get()
+                    if message is None:
+                        self._finish(job, {
+                            'event': 'error',
+                            'message': 'The worker exited unexpectedly.'})
+                        break
+                    elif message[0] == 'witness':
+                        job.publish({'event': 'witness',
+                                     'witness': message[1]})
+                    elif message[0] == 'done':
+                        self._finish(job, {'event': 'done',
+                                           'witnesses': message[1],
+                                           'stats': message[2]})
+                        break
+                    else:
+                        self._finish(job, {'event': 'error',
+                                           'message': message[1]})
+                        break
+            finally:
+                loop.remove_reader(receiver.fileno())
+                receiver.close()
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Serves wat queries over trace files.')
+    address = parser.add_mutually_exclusive_group(required=True)
+    address.add_argument('--socket', help='The Unix socket to listen on.')
+    address.add_argument('--port', type=int,
+                         help='The localhost TCP port to listen on.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='The most queries to run at once.')
+    parser.add_argument('--allow-import', action='store_true',
+                        help='Allow machines named "module:Class".')
+    parser.add_argument('--trust', action='append', default=['wat'],
+                        help='A package that trace files may load classes '
+                             'from. Can be repeated.')
+    args = parser.parse_args()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = WatServer(args.workers, args.allow_import, tuple(args.trust))
+    loop.run_until_complete(server.start(args.socket, args.port))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(server.close())
+        loop.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+from typing import (Any, Callable, Dict, FrozenSet, List, Optional, Set, Tuple,
+                    Type)
+
+from .db import (Db, DbCreateRequest, DbCross, DbCup, DbInsertRequest,
+                 DbJoin, DbProject, DbQuery, DbQueryReply, DbQueryRequest,
+                 DbRelation, DbSelect, Record)
+from .kvs import (Kvs, KvsAddRequest, KvsGetReply, KvsGetRequest,
+                  KvsSetRequest)
+from .lists import (Lists, ListsIndexReply, ListsIndexRequest,
+                    ListsLpopReply, ListsLpopRequest, ListsLpushRequest,
+                    ListsRpopReply, ListsRpopRequest, ListsRpushRequest)
+from .state_machine import StateMachine
+
+# A provenance spec computes the wat provenance of an output in closed form,
+# without replaying any subtraces. It is passed the state machine, the inputs
+# that precede the queried input, and the queried input/output pair, and it
+# returns the witnesses as lists of indexes into the inputs. A spec can return
+# any superset of the witnesses wat returns as long as it only contains minimal
+# witnesses, since wat drops the witnesses that happen before another.
+#
+# A spec returns None if it does not apply to the trace, in which case wat
+# falls back to searching for the witnesses.
+ProvenanceSpec = Callable[[Any, List[Any], Any, Any], Optional[List[List[int]]]]
+
+_SPECS: Dict[Tuple[type, type], ProvenanceSpec] = dict()
+
+def register_spec(machine_type: Type[StateMachine],
+                  input_type: type,
+                  spec: ProvenanceSpec) \
+                  -> None:
+    """Registers spec for the inputs of type input_type to machine_type."""
+    _SPECS[(machine_type, input_type)] = spec
+
+def provenance_spec(machine_type: Type[StateMachine], *input_types: type) \
+                    -> Callable[[ProvenanceSpec], ProvenanceSpec]:
+    """A decorator that registers a spec for one or more input types."""
+    def register(spec: ProvenanceSpec) -> ProvenanceSpec:
+        for input_type in input_types:
+            register_spec(machine_type, input_type, spec)
+        return spec
+    return register
+
+def find_spec(m: StateMachine, i: Any) -> Optional[ProvenanceSpec]:
+    """Returns the spec registered for i and m or m's closest superclass."""
+    for machine_type in type(m).__mro__:
+        spec = _SPECS.get((machine_type, type(i)))
+        if spec is not None:
+            return spec
+    return None
+
+def spec_provenance(m: StateMachine, inputs: List[Any], i: Any, o: Any) \
+                    -> Optional[List[List[int]]]:
+    spec = find_spec(m, i)
+    if spec is None:
+        return None
+    return spec(m, inputs, i, o)
+
+# Kvs ##########################################################################
+@provenance_spec(Kvs, KvsGetRequest)
+def kvs_get_spec(m: Kvs,
+                 inputs: List[Any],
+                 i: KvsGetRequest,
+                 o: KvsGetReply) \
+                 -> Optional[List[List[int]]]:
+    """A get is explained by the last set to the same key.
+
+    Adds make the value of a key depend on every earlier set and add to it, so
+    the spec does not apply if any add touches the key.
+    """
+    last_set: Optional[int] = None
+    for (j, x) in enumerate(inputs):
+        if isinstance(x, KvsAddRequest) and x.k == i.k:
+            return None
+        if isinstance(x, KvsSetRequest) and x.k == i.k:
+            last_set = j
+
+    if last_set is None:
+        return [[]] if o == KvsGetReply(None) else None
+    if o != KvsGetReply(inputs[last_set].v):
+        return None
+    return [[last_set]]
+
+# Lists ########################################################################
+@provenance_spec(Lists, ListsIndexRequest, ListsLpopRequest, ListsRpopRequest)
+def lists_read_spec(m: Lists,
+                    inputs: List[Any],
+                    i: Any,
+                    o: Any) \
+                    -> Optional[List[List[int]]]:
+    """An element is explained by the pushes that put it at its position.
+
+    The spec only applies to traces of pushes and index requests that push
+    distinct values. The list is then the lpushes, latest first, followed by
+    the rpushes. An element rpushed by r is at its position in every
+    supertrace exactly when every lpush and every earlier rpush is present,
+    and an element lpushed by l is at its position exactly when every later
+    lpush is present.
+    """
+    lpushes: List[int] = []
+    rpushes: List[int] = []
+    for (j, x) in enumerate(inputs):
+        if isinstance(x, ListsLpushRequest):
+            lpushes.append(j)
+        elif isinstance(x, ListsRpushRequest):
+            rpushes.append(j)
+        elif not isinstance(x, ListsIndexRequest):
+            return None
+    values = [inputs[j].x for j in lpushes + rpushes]
+    if len(set(values)) != len(values):
+        return None
+
+    xs = list(reversed(lpushes)) + rpushes
+    if isinstance(i, ListsIndexRequest):
+        position = i.i
+        reply_type: type = ListsIndexReply
+    elif isinstance(i, ListsLpopRequest):
+        position = 0
+        reply_type = ListsLpopReply
+    else:
+        position = len(xs) - 1
+        reply_type = ListsRpopReply
+
+    if not 0 <= position < len(xs):
+        return [[]] if o == reply_type(None) else None
+    pusher = xs[position]
+    if o != reply_type(inputs[pusher].x):
+        return None
+
+    if isinstance(i, ListsRpopRequest):
+        # The last element is the last rpush or, if there are none, the first
+        # lpush. Either stays last in every supertrace.
+        return [[pusher]]
+    elif pusher in rpushes:
+        return [sorted(lpushes + [j for j in rpushes if j <= pusher])]
+    else:
+        return [[j for j in lpushes if j >= pusher]]
+
+# Db ###########################################################################
+# The why-provenance of a query maps every record in its result to the minimal
+# sets of inserts, given as input indexes, that each derive the record.
+_WhyProvenance = Dict[Record, Set[FrozenSet[int]]]
+
+def _minimize(witnesses: Set[FrozenSet[int]]) -> Set[FrozenSet[int]]:
+    return {w for w in witnesses if not any(v < w for v in witnesses)}
+
+def _why_provenance(q: DbQuery, db: Dict[str, _WhyProvenance]) \
+                    -> Optional[_WhyProvenance]:
+    """Evaluates q, annotating every record with its why-provenance.
+
+    Returns None if q is not a monotone query, for which the why-provenance of
+    its result would not explain it.
+    """
+    if isinstance(q, DbRelation):
+        return db[q.r]
+    elif isinstance(q, DbSelect):
+        child = _why_provenance(q.child, db)
+        if child is None:
+            return None
+        return {t: ws for (t, ws) in child.items() if q.f(t)}
+    elif isinstance(q, DbProject):
+        child = _why_provenance(q.child, db)
+        if child is None:
+            return None
+        projected: _WhyProvenance = dict()
+        for t, ws in child.items():
+            projection = tuple(t[i] for i in q.indexes)
+            projected.setdefault(projection, set()).update(ws)
+        return {t: _minimize(ws) for (t, ws) in projected.items()}
+    elif isinstance(q, DbCup):
+        lhs = _why_provenance(q.lhs, db)
+        rhs = _why_provenance(q.rhs, db)
+        if lhs is None or rhs is None:
+            return None
+        union = {t: set(ws) for (t, ws) in lhs.items()}
+        for t, ws in rhs.items():
+            union.setdefault(t, set()).update(ws)
+        return {t: _minimize(ws) for (t, ws) in union.items()}
+    elif isinstance(q, DbCross):
+        lhs = _why_provenance(q.lhs, db)
+        rhs = _why_provenance(q.rhs, db)
+        if lhs is None or rhs is None:
+            return None
+        return {l + r: _minimize({v | w for v in vs for w in ws})
+                for (l, vs) in lhs.items()
+                for (r, ws) in rhs.items()}
+    elif isinstance(q, DbJoin):
+        lhs = _why_provenance(q.lhs, db)
+        rhs = _why_provenance(q.rhs, db)
+        if lhs is None or rhs is None:
+            return None
+        return {l + r: _minimize({v | w for v in vs for w in ws})
+                for (l, vs) in lhs.items()
+                for (r, ws) in rhs.items()
+                if all(l[i] == r[j]
+                       for (i, j) in zip(q.lhs_columns, q.rhs_columns))}
+    else:
+        return None
+
+def _strict_relations(q: DbQuery) -> Set[str]:
+    """Returns the relations that evaluating q always reads.
+
+    A cross product or join only evaluates its right-hand side if its
+    left-hand side is not empty, so a query can read a relation that does not
+    exist without failing.
+    """
+    if isinstance(q, DbRelation):
+        return {q.r}
+    elif isinstance(q, (DbSelect, DbProject)):
+        return _strict_relations(q.child)
+    elif isinstance(q, (DbCross, DbJoin)):
+        return _strict_relations(q.lhs)
+    elif isinstance(q, DbCup):
+        return _strict_relations(q.lhs) | _strict_relations(q.rhs)
+    else:
+        return q.relations()
+
+@provenance_spec(Db, DbQueryRequest)
+def db_query_spec(m: Db,
+                  inputs: List[Any],
+                  i: DbQueryRequest,
+                  o: DbQueryReply) \
+                  -> Optional[List[List[int]]]:
+    """A monotone query is explained by its why-provenance.
+
+    The spec only applies to traces without deletes in which every relation
+    the query reads is created once, before it is inserted into, and to
+    queries that always read every relation they mention. A subtrace with
+    those creates produces a subset of the result, so it is closed under
+    superset exactly when it derives every record of the result. The
+    witnesses are the creates plus a minimal choice of inserts that derives
+    every record.
+    """
+    relations = i.q.relations()
+    if _strict_relations(i.q) != relations:
+        return None
+    creates: Dict[str, int] = dict()
+    db: Dict[str, _WhyProvenance] = dict()
+    for (j, x) in enumerate(inputs):
+        if isinstance(x, DbCreateRequest):
+            if x.r in creates:
+                return None
+            creates[x.r] = j
+            db[x.r] = dict()
+        elif isinstance(x, DbInsertRequest):
+            if x.r not in creates:
+                if x.r in relations:
+                    return None
+                continue
+            db[x.r].setdefault(tuple(x.t), set()).add(frozenset([j]))
+        elif not isinstance(x, DbQueryRequest):
+            return None
+
+    if not relations <= set(creates):
+        return [[]] if o == DbQueryReply(None) else None
+
+    result = _why_provenance(i.q, db)
+    if result is None or o != DbQueryReply(set(result)):
+        return None
+
+    witnesses = {frozenset(creates[r] for r in relations)}
+    for ws in result.values():
+        witnesses = _minimize({v | w for v in witnesses for w in ws})
+    return [sorted(w) for w in witnesses]
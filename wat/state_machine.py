@@ -1,4 +1,5 @@
-from typing import List, Tuple, TypeVar, Generic
+from typing import (AbstractSet, Any, Hashable, List, Optional, Set, Tuple,
+                    TypeVar, Generic)
 
 Input = TypeVar('Input')
 Output = TypeVar('Output')
@@ -20,6 +21,73 @@ class StateMachine(Generic[Input, Output]):
         """Transitions to a new state and outputs and ouput."""
         raise NotImplementedError()
 
+    def snapshot(self) -> Any:
+        """Returns a copy of the current state.
+
+        snapshot and restore are optional. If a state machine implements them,
+        wat can replay a subtrace starting from the state after a prefix it has
+        already replayed instead of starting over from the start state.
+        """
+        raise NotImplementedError()
+
+    def restore(self, state: Any) -> None:
+        """Returns to a state previously returned by snapshot.
+
+        The same state can be restored any number of times, so restore must not
+        let later transitions modify it.
+        """
+        raise NotImplementedError()
+
+    def configuration(self) -> Any:
+        """Returns what, besides its class, determines how the machine behaves.
+
+        Two machines of the same class with equal configurations must produce
+        the same trace from the same inputs. wat's ResultCache uses the
+        configuration to tell machines apart. The default, None, is right for
+        machines that are fully determined by their class.
+        """
+        return None
+
+    def run_batch(self, inputs: List[Input], masks: List[int], i: Input) \
+                  -> List[Output]:
+        """Returns the output of i after each subtrace of inputs in masks.
+
+        Bit j of a mask is set if the subtrace contains the jth input. The
+        result is the same as running every subtrace and then transitioning
+        on i, but run_batch is optional. A state machine can implement it to
+        replay all of the subtraces at once, keeping its state as columns
+        with one entry per mask (see mask_column). run_batch must not change
+        the current state.
+        """
+        raise NotImplementedError()
+
+    def footprint(self, i: Input) -> Optional[AbstractSet[Hashable]]:
+        """Returns the parts of the state that i reads or writes.
+
+        footprint is optional. It must not depend on the current state, and
+        inputs with disjoint footprints must commute and not affect each
+        other's outputs. wat uses footprints to slice away the inputs that an
+        output cannot depend on. A footprint of None, the default, means that
+        i may read or write anything.
+        """
+        return None
+
+    def symmetry_key(self, i: Input) -> Optional[Hashable]:
+        """Returns a key shared by the inputs that are interchangeable with i.
+
+        Two inputs are interchangeable if transitioning on either one always
+        has the same effect on the state. wat searches a run of
+        interchangeable inputs as a single input that can be repeated, rather
+        than trying every subset of the run. A key of None means that i is not
+        interchangeable with any other input. By default, equal hashable
+        inputs of the same type are interchangeable.
+        """
+        try:
+            hash(i)
+        except TypeError:
+            return None
+        return (type(i), i)
+
     def run(self, inputs: List[Input]) -> List[Tuple[Input, Output]]:
         """Performs a sequence of transitions from the start state."""
         self.reset()
@@ -28,3 +96,12 @@ class StateMachine(Generic[Input, Output]):
             o = self.transition(i)
             trace.append((i, o))
         return trace
+
+def mask_column(masks: List[int], j: int) -> int:
+    """Returns the masks that contain the jth input, as a bitmask.
+
+    Bit b of the column is set if bit j of masks[b] is set. Columns let the
+    state of many replays be updated together with bitwise operations.
+    """
+    bits = ''.join('1' if mask >> j & 1 else '0' for mask in reversed(masks))
+    return int(bits, 2) if len(bits) > 0 else 0
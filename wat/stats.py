@@ -0,0 +1,104 @@
+from typing import Dict, Tuple
+
+class WatStats:
+    """Counts and times the work done by wat queries.
+
+    Collecting stats is opt-in: pass a WatStats to wat, iter_wat, wat_many, or
+    wat_one, and it accumulates over every query it is passed to.
+
+    - oracle_calls counts the checks of whether a subtrace satisfies the
+      queried input/output pair, and replays counts the checks that were not
+      cached and had to replay the subtrace.
+    - transitions counts StateMachine.transition calls made while replaying.
+      A subtrace replayed by StateMachine.run_batch counts as many
+      transitions as replaying it one input at a time would take.
+    - subtraces_enumerated counts the candidate subtraces considered by the
+      search, and subtraces_pruned counts the candidates the level-wise search
+      skipped because they contain a closed subtrace.
+    - deadlines_exceeded counts the queries cut short by their deadline, whose
+      results may be missing witnesses.
+    - total_seconds is the time spent in queries, of which replay_seconds was
+      spent replaying and filter_seconds was spent filtering witnesses that
+      are not minimal or that happen before another witness. The rest,
+      search_seconds, was spent enumerating subtraces.
+
+    The workers of a parallel query add their counts and times to the stats as
+    well, so replay_seconds can exceed total_seconds.
+    """
+    def __init__(self) -> None:
+        self.oracle_calls = 0
+        self.replays = 0
+        self.transitions = 0
+        self.subtraces_enumerated = 0
+        self.subtraces_pruned = 0
+        self.deadlines_exceeded = 0
+        self.total_seconds = 0.0
+        self.replay_seconds = 0.0
+        self.filter_seconds = 0.0
+
+    @property
+    def search_seconds(self) -> float:
+        return self.total_seconds - self.replay_seconds - self.filter_seconds
+
+    def merge(self, other: 'WatStats') -> None:
+        for name, value in vars(other).items():
+            setattr(self, name, getattr(self, name) + value)
+
+    def as_dict(self) -> Dict[str, float]:
+        d = dict(vars(self))
+        d['search_seconds'] = self.search_seconds
+        return d
+
+    def __str__(self) -> str:
+        fields = ', '.join(f'{name}={value}'
+                           for (name, value) in self.as_dict().items())
+        return f'WatStats({fields})'
+
+    def __repr__(self) -> str:
+        return str(self)
+
+class RuleStats:
+    """Counts and times the evaluations of a single WhiteBox rule.
+
+    records counts the records the rule's query produced, and witnesses counts
+    the witnesses in their lineages. max_lineage is the most witnesses in the
+    lineage of any one record.
+    """
+    def __init__(self) -> None:
+        self.evaluations = 0
+        self.seconds = 0.0
+        self.records = 0
+        self.witnesses = 0
+        self.max_lineage = 0
+
+    def __str__(self) -> str:
+        return (f'RuleStats(evaluations={self.evaluations}, '
+                f'seconds={self.seconds}, records={self.records}, '
+                f'witnesses={self.witnesses}, '
+                f'max_lineage={self.max_lineage})')
+
+    def __repr__(self) -> str:
+        return str(self)
+
+class WhiteBoxStats:
+    """Counts and times the rules run by WhiteBox.transition.
+
+    Collecting stats is opt-in: set the stats attribute of a WhiteBox to a
+    WhiteBoxStats. rules maps the name of a request relation and the index of
+    one of its rules to the stats of that rule.
+    """
+    def __init__(self) -> None:
+        self.transitions = 0
+        self.rules: Dict[Tuple[str, int], RuleStats] = dict()
+
+    def rule(self, relation_name: str, index: int) -> RuleStats:
+        key = (relation_name, index)
+        if key not in self.rules:
+            self.rules[key] = RuleStats()
+        return self.rules[key]
+
+    def __str__(self) -> str:
+        return f'WhiteBoxStats(transitions={self.transitions}, {self.rules})'
+
+    def __repr__(self) -> str:
+        return str(self)
@@ -0,0 +1,298 @@
+import importlib
+import json
+import mmap
+import os
+import struct
+import types
+from typing import (Any, BinaryIO, Dict, Hashable, Iterable, Iterator, List,
+                    Optional, Tuple, Union, overload)
+
+# A trace file stores a trace of input/output pairs. Every distinct input and
+# output is stored once in a dictionary, and the trace itself is an array of
+# fixed-width records, one per pair, holding the dictionary ids of the input
+# and output. A file is laid out as follows, with every integer little-endian:
+#
+#   header      magic, version, record count, entries offset, table offset,
+#               and entry count (see _HEADER)
+#   records     one (input id, output id) pair of uint32s per input/output pair
+#   entries     the dictionary entries, each a UTF-8 encoded JSON value
+#   table       entry count + 1 uint64 offsets; entry k spans offsets k and k+1
+#
+# Values are encoded as JSON. None, booleans, numbers, and strings are encoded
+# as themselves, and every other value is encoded as an object tagged with its
+# type (see _encode). NamedTuples and other objects are encoded by the module
+# and name of their class, and functions by their module and name, so lambdas
+# cannot be stored.
+_MAGIC = b'WATTRACE'
+_VERSION = 1
+_HEADER = struct.Struct('<8sIIQQQQ')
+_RECORD = struct.Struct('<II')
+_OFFSET = struct.Struct('<Q')
+
+class TraceFileError(Exception):
+    pass
+
+def _qualified_name(x: Any) -> str:
+    name = f'{x.__module__}:{x.__qualname__}'
+    if '<' in name:
+        raise TraceFileError(f'Cannot store "{x}", which has no importable '
+                             'name.')
+    return name
+
+def _encode(x: Any) -> Any:
+    if x is None or isinstance(x, (bool, int, float, str)):
+        return x
+    elif isinstance(x, tuple) and hasattr(x, '_fields'):
+        return {'t': 'namedtuple',
+                'c': _qualified_name(type(x)),
+                'v': [_encode(y) for y in x]}
+    elif isinstance(x, tuple):
+        return {'t': 'tuple', 'v': [_encode(y) for y in x]}
+    elif isinstance(x, list):
+        return {'t': 'list', 'v': [_encode(y) for y in x]}
+    elif isinstance(x, (set, frozenset)):
+        # Sets are sorted so that equal sets are interned together.
+        encoded = [_encode(y) for y in x]
+        encoded.sort(key=lambda y: json.dumps(y, sort_keys=True))
+        return {'t': type(x).__name__, 'v': encoded}
+    elif isinstance(x, dict):
+        return {'t': 'dict', 'v': [[_encode(k), _encode(v)]
+                                   for (k, v) in x.items()]}
+    elif isinstance(x, (types.FunctionType, type)):
+        return {'t': 'name', 'c': _qualified_name(x)}
+    elif hasattr(x, '__dict__'):
+        return {'t': 'object',
+                'c': _qualified_name(type(x)),
+                'v': {k: _encode(v) for (k, v) in vars(x).items()}}
+    else:
+        raise TraceFileError(f'Cannot store "{x}".')
+
+def _exact_key(x: Any) -> Optional[Hashable]:
+    """Returns a key for x that is equal only for values encoded the same.
+
+    Equal values can have different encodings, e.g. 1, 1.0, and True, or 0.0
+    and -0.0, so the key includes the type of x and of every value nested in
+    it, and floats are keyed by their repr. Only scalars and tuples of them
+    have keys; None is returned for every other value.
+    """
+    if x is None or isinstance(x, (bool, int, str)):
+        return (type(x), x)
+    elif isinstance(x, float):
+        return (float, repr(x))
+    elif isinstance(x, tuple):
+        keys = []
+        for y in x:
+            key = _exact_key(y)
+            if key is None:
+                return None
+            keys.append(key)
+        return (type(x), tuple(keys))
+    else:
+        return None
+
+def _import(name: str, trusted_packages: Tuple[str, ...]) -> Any:
+    module_name, qualname = name.split(':')
+    if not any(module_name == p or module_name.startswith(p + '.')
+               for p in trusted_packages):
+        raise TraceFileError(f'Refusing to load "{name}" from a package '
+                             f'outside {trusted_packages}.')
+    x = importlib.import_module(module_name)
+    for attribute in qualname.split('.'):
+        x = getattr(x, attribute)
+    return x
+
+def _decode(x: Any, trusted_packages: Tuple[str, ...]) -> Any:
+    if not isinstance(x, dict):
+        return x
+
+    tag = x['t']
+    if tag == 'name':
+        return _import(x['c'], trusted_packages)
+
+    if tag == 'object':
+        klass = _import(x['c'], trusted_packages)
+        obj = klass.__new__(klass)
+        obj.__dict__.update({k: _decode(v, trusted_packages)
+                             for (k, v) in x['v'].items()})
+        return obj
+
+    if tag == 'dict':
+        return {_decode(k, trusted_packages): _decode(v, trusted_packages)
+                for (k, v) in x['v']}
+
+    values = [_decode(y, trusted_packages) for y in x['v']]
+    if tag == 'namedtuple':
+        return _import(x['c'], trusted_packages)(*values)
+    elif tag == 'tuple':
+        return tuple(values)
+    elif tag == 'list':
+        return values
+    elif tag == 'set':
+        return set(values)
+    elif tag == 'frozenset':
+        return frozenset(values)
+    else:
+        raise TraceFileError(f'Unrecognized tag "{tag}".')
+
+class TraceWriter:
+    """Writes a trace file at path, one input/output pair at a time.
+
+    The records are written as they are appended, but the dictionary is kept
+    in memory until the writer is closed. Values are interned by their
+    encoding, and values with an _exact_key are first looked up by it to
+    avoid encoding them again.
+    """
+    def __init__(self, path: str) -> None:
+        self.f: BinaryIO = open(path, 'wb')
+        self.f.write(b'\0' * _HEADER.size)
+        self.ids: Dict[str, int] = dict()
+        self.key_ids: Dict[Hashable, int] = dict()
+        self.entries: List[bytes] = []
+        self.count = 0
+
+    def __enter__(self) -> 'TraceWriter':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def _intern(self, x: Any) -> int:
+        key = _exact_key(x)
+        if key is not None and key in self.key_ids:
+            return self.key_ids[key]
+
+        entry = json.dumps(_encode(x), sort_keys=True)
+        if entry not in self.ids:
+            self.ids[entry] = len(self.entries)
+            self.entries.append(entry.encode('utf-8'))
+        if key is not None:
+            self.key_ids[key] = self.ids[entry]
+        return self.ids[entry]
+
+    def append(self, i: Any, o: Any) -> None:
+        self.f.write(_RECORD.pack(self._intern(i), self._intern(o)))
+        self.count += 1
+
+    def close(self) -> None:
+        if self.f.closed:
+            return
+
+        entries_offset = self.f.tell()
+        offset = 0
+        offsets = [offset]
+        for entry in self.entries:
+            self.f.write(entry)
+            offset += len(entry)
+            offsets.append(offset)
+        table_offset = self.f.tell()
+        for offset in offsets:
+            self.f.write(_OFFSET.pack(offset))
+
+        self.f.seek(0)
+        self.f.write(_HEADER.pack(_MAGIC, _VERSION, 0, self.count,
+                                  entries_offset, table_offset,
+                                  len(self.entries)))
+        self.f.close()
+
+def write_trace(path: str, trace: Iterable[Tuple[Any, Any]]) -> None:
+    """Writes trace to a trace file at path."""
+    with TraceWriter(path) as writer:
+        for i, o in trace:
+            writer.append(i, o)
+
+class TraceReader:
+    """A trace stored in a trace file, memory-mapped and decoded lazily.
+
+    A TraceReader can be indexed and sliced like a list of input/output
+    pairs, so it can be passed to wat as a trace. Indexing reads a single
+    record, and every input and output is decoded the first time it is read.
+
+    Decoding a value can import the module that defines its class, so classes
+    and functions are only loaded from the packages in trusted_packages.
+    """
+    def __init__(self,
+                 path: str,
+                 trusted_packages: Tuple[str, ...] = ('wat',)) -> None:
+        self.trusted_packages = trusted_packages
+        self.f = open(path, 'rb')
+        try:
+            # An empty file cannot be memory-mapped, so the size is checked
+            # first.
+            if os.fstat(self.f.fileno()).st_size < _HEADER.size:
+                raise TraceFileError(f'"{path}" is not a trace file.')
+            self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        except BaseException:
+            self.f.close()
+            raise
+        try:
+            header = _HEADER.unpack_from(self.mm, 0)
+            magic, version, _, count, entries_offset, table_offset, entries = \
+                header
+            if magic != _MAGIC:
+                raise TraceFileError(f'"{path}" is not a trace file.')
+            if version != _VERSION:
+                raise TraceFileError('Unsupported trace file version '
+                                     f'{version}.')
+        except BaseException:
+            self.close()
+            raise
+        self.count = count
+        self.entries_offset = entries_offset
+        self.table_offset = table_offset
+        self.num_entries = entries
+        self.values: Dict[int, Any] = dict()
+
+    def __enter__(self) -> 'TraceReader':
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.mm.close()
+        self.f.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def value(self, k: int) -> Any:
+        """Returns the kth entry of the dictionary."""
+        if k not in self.values:
+            assert 0 <= k < self.num_entries, (k, self.num_entries)
+            start, = _OFFSET.unpack_from(self.mm, self.table_offset + 8 * k)
+            end, = _OFFSET.unpack_from(self.mm, self.table_offset + 8 * k + 8)
+            entry = self.mm[self.entries_offset + start:
+                            self.entries_offset + end]
+            self.values[k] = _decode(json.loads(entry.decode('utf-8')),
+                                     self.trusted_packages)
+        return self.values[k]
+
+    def _pair(self, j: int) -> Tuple[Any, Any]:
+        i, o = _RECORD.unpack_from(self.mm, _HEADER.size + _RECORD.size * j)
+        return (self.value(i), self.value(o))
+
+    @overload
+    def __getitem__(self, j: int) -> Tuple[Any, Any]:
+        ...
+
+    @overload
+    def __getitem__(self, j: slice) -> List[Tuple[Any, Any]]:
+        ...
+
+    def __getitem__(self, j: Union[int, slice]) \
+                    -> Union[Tuple[Any, Any], List[Tuple[Any, Any]]]:
+        if isinstance(j, slice):
+            return [self._pair(k) for k in range(*j.indices(self.count))]
+        k = j + self.count if j < 0 else j
+        if not 0 <= k < self.count:
+            raise IndexError(j)
+        return self._pair(k)
+
+    def __iter__(self) -> Iterator[Tuple[Any, Any]]:
+        for j in range(self.count):
+            yield self._pair(j)
+
+    def inputs(self) -> Iterator[Any]:
+        """Yields the inputs of the trace, e.g. to replay them."""
+        for i, _ in self:
+            yield i
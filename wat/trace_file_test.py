@@ -0,0 +1,57 @@
+from typing import Any, List, Tuple
+import gc
+import os
+import tempfile
+import unittest
+import warnings
+
+from .kvs import Kvs
+from .trace_file import TraceFileError, TraceReader, write_trace
+
+class TraceFileTest(unittest.TestCase):
+    def setUp(self) -> None:
+        fd, self.path = tempfile.mkstemp(suffix='.trace')
+        os.close(fd)
+
+    def tearDown(self) -> None:
+        os.remove(self.path)
+
+    def test_round_trip(self) -> None:
+        m = Kvs()
+        trace = m.run([m.set('x', 1), m.get('x'), m.set('y', 2),
+                       m.get('y'), m.get('w')])
+        write_trace(self.path, trace)
+        with TraceReader(self.path) as reader:
+            self.assertEqual(len(reader), len(trace))
+            self.assertEqual(list(reader), trace)
+            self.assertEqual(reader[-1], trace[-1])
+            self.assertEqual(reader[1:4], trace[1:4])
+            with self.assertRaises(IndexError):
+                reader[len(trace)]
+
+    def test_equal_values_of_different_types(self) -> None:
+        # 1, 1.0, and True are equal and hash the same, in and out of tuples,
+        # as are 0.0 and -0.0, but each must be read back as itself.
+        values = [1, 1.0, True, 0, 0.0, -0.0, False, (1,), (1.0,), (True,),
+                  ((0, False),), ((0.0, 0),), ((-0.0, 0),), [1], [True]]
+        trace: List[Tuple[Any, Any]] = [(('x', v), v) for v in values]
+        trace += [(v, [v]) for v in values]
+        write_trace(self.path, trace)
+        with TraceReader(self.path) as reader:
+            self.assertEqual(repr(list(reader)), repr(trace))
+
+    def test_invalid_files(self) -> None:
+        contents = [b'', b'WATTRACE', b'NOTTRACE' + b'\0' * 64]
+        for content in contents:
+            with open(self.path, 'wb') as f:
+                f.write(content)
+            # A reader that fails to open must close the file it opened.
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always', ResourceWarning)
+                with self.assertRaises(TraceFileError):
+                    TraceReader(self.path)
+                gc.collect()
+            self.assertEqual([w.message for w in caught], [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,15 @@
-from itertools import chain, combinations
-from typing import Generator, Generic, Iterable, List, Set, Tuple, TypeVar
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations, islice
+import time
+from typing import (AbstractSet, Any, Callable, Dict, Generator, Generic,
+                    Hashable, Iterator, List, NamedTuple, Optional, Set, Tuple,
+                    TypeVar)
 
+from .result_cache import ResultCache
+from .specs import spec_provenance
 from .state_machine import StateMachine
+from .stats import WatStats
 
 Input = TypeVar('Input')
 Output = TypeVar('Output')
@@ -14,80 +22,1036 @@ def _enumerate_trace(trace: Trace) -> EnumeratedTrace:
 def _unenumerate_trace(enumerated_trace: EnumeratedTrace) -> Trace:
     return [(i, o) for (j, i, o) in enumerated_trace]
 
-# https://docs.python.org/3/library/itertools.html#recipes
-T = TypeVar('T')
-def _powerset(iterable: Iterable[T],
-              min_size: int = 0) \
-              -> Generator[List[T], None, None]:
-    "powerset([1,2,3]) --> () (1,) (2,) (3,) (1,2) (1,3) (2,3) (1,2,3)"
-    s = list(iterable)
-    sizes = range(min_size, len(s) + 1)
-    for t in chain.from_iterable(combinations(s, r) for r in sizes):
-        yield list(t)
-
-def _subtraces(trace: EnumeratedTrace) \
-               -> Generator[EnumeratedTrace, None, None]:
-    indexes = range(len(trace))
-    for index_set in _powerset(indexes):
-        yield [trace[i] for i in sorted(index_set)]
-
-def _supertraces(subtrace: EnumeratedTrace, trace: EnumeratedTrace) \
-                 -> Generator[EnumeratedTrace, None, None]:
-    subtrace_index_set = set(j for (j, _, _) in subtrace)
-    indexes = range(len(trace))
-    for index_set in _powerset(indexes, min_size=len(subtrace)):
-        if subtrace_index_set <= set(index_set):
-            yield [trace[j] for j in sorted(index_set)]
-
-def _trace_happens_before(a: EnumeratedTrace, b: EnumeratedTrace) -> bool:
-    (j, _, _) = a[-1]
-    (k, _, _) = b[0]
+# Subtraces of an n-input trace are represented as n-bit integers. Bit j of a
+# subtrace is set if the subtrace contains the jth input of the trace.
+def _popcount(mask: int) -> int:
+    return bin(mask).count('1')
+
+def _indexes(mask: int) -> List[int]:
+    indexes: List[int] = []
+    while mask != 0:
+        lowest = mask & -mask
+        indexes.append(lowest.bit_length() - 1)
+        mask ^= lowest
+    return indexes
+
+def _subtrace(trace: EnumeratedTrace, mask: int) -> EnumeratedTrace:
+    return [trace[j] for j in _indexes(mask)]
+
+def _lexicographic_key(mask: int) -> Tuple[int, List[int]]:
+    return (_popcount(mask), _indexes(mask))
+
+def _powerset(n: int, min_size: int = 0) -> Generator[int, None, None]:
+    """Yields every subset of n elements, smallest first."""
+    for size in range(min_size, n + 1):
+        # Gosper's hack enumerates the n-bit integers with size bits set in
+        # increasing order.
+        mask = (1 << size) - 1
+        while mask < (1 << n):
+            yield mask
+            if mask == 0:
+                break
+            lowest = mask & -mask
+            ripple = mask + lowest
+            mask = (((ripple ^ mask) >> 2) // lowest) | ripple
+
+def _subtraces(mask: int) -> Generator[int, None, None]:
+    """Yields every subtrace of mask, including mask itself."""
+    subtrace = mask
+    while True:
+        yield subtrace
+        if subtrace == 0:
+            break
+        subtrace = (subtrace - 1) & mask
+
+def _supertraces(mask: int, n: int) -> Generator[int, None, None]:
+    """Yields every subtrace of an n-input trace that contains mask."""
+    complement = ((1 << n) - 1) & ~mask
+    for extra in _subtraces(complement):
+        yield mask | extra
+
+def _trace_happens_before(a: int, b: int) -> bool:
+    j = a.bit_length() - 1
+    k = (b & -b).bit_length() - 1
     return j < k
 
-def _trace_satisfies_io(m: StateMachine[Input, Output],
-                        trace: EnumeratedTrace,
+class _Replayer(Generic[Input, Output]):
+    """Replays subtraces of a trace on a state machine.
+
+    If the state machine implements snapshot and restore, the replayer keeps
+    snapshots of the states reached after the prefixes of the subtraces it has
+    replayed, keyed by prefix bitmask. Replaying a subtrace restores the
+    snapshot of its longest known prefix and only transitions through the
+    rest. Once max_snapshots snapshots are kept, the least recently used one
+    is evicted. Snapshots do not depend on what is being queried, so a
+    replayer can be shared by every query over the same trace. If the state
+    machine does not implement snapshot, every subtrace is replayed from the
+    start state.
+
+    If the state machine implements run_batch, many subtraces can be replayed
+    at once by transition_batch, in blocks of at most batch_size subtraces.
+    batched is False once the state machine is found not to implement it.
+
+    The replays are counted and timed in stats, if it is not None. Every
+    function that is passed a replayer records its stats there as well.
+    """
+    def __init__(self,
+                 m: StateMachine[Input, Output],
+                 inputs: List[Input],
+                 max_snapshots: int = 2**10,
+                 stats: Optional[WatStats] = None,
+                 batch_size: int = 2**14) -> None:
+        self.m = m
+        self.inputs = inputs
+        self.max_snapshots = max_snapshots
+        self.stats = stats
+        self.batch_size = batch_size
+        self.batched = True
+        self.start: Optional[Any] = None
+        self.snapshots: Dict[int, Any] = OrderedDict()
+
+        m.reset()
+        try:
+            self.start = m.snapshot()
+        except NotImplementedError:
+            pass
+
+    def transition(self, mask: int, i: Input) -> Output:
+        """Replays the subtrace mask and then returns the output of i."""
+        if self.stats is None:
+            return self._replay(mask, i)
+
+        start = time.perf_counter()
+        output = self._replay(mask, i)
+        self.stats.replay_seconds += time.perf_counter() - start
+        return output
+
+    def transition_batch(self, masks: List[int], i: Input) \
+                         -> Optional[List[Output]]:
+        """Returns the output of i after each subtrace in masks.
+
+        Returns None if the state machine does not implement run_batch.
+        """
+        if not self.batched:
+            return None
+
+        start = time.perf_counter()
+        outputs: List[Output] = []
+        try:
+            for k in range(0, len(masks), self.batch_size):
+                block = masks[k:k + self.batch_size]
+                outputs += self.m.run_batch(self.inputs, block, i)
+        except NotImplementedError:
+            self.batched = False
+            return None
+        if self.stats is not None:
+            self.stats.replay_seconds += time.perf_counter() - start
+            # run_batch replays every input of every mask, and then i.
+            self.stats.transitions += sum(_popcount(mask) + 1
+                                          for mask in masks)
+        return outputs
+
+    def _replay(self, mask: int, i: Input) -> Output:
+        indexes = _indexes(mask)
+        if self.start is None:
+            if self.stats is not None:
+                self.stats.transitions += len(indexes) + 1
+            self.m.run([self.inputs[j] for j in indexes])
+            return self.m.transition(i)
+
+        # prefixes[k] is the subtrace of the first k inputs of mask.
+        prefixes = [0]
+        for j in indexes:
+            prefixes.append(prefixes[-1] | (1 << j))
+        replayed = len(indexes)
+        while replayed > 0 and prefixes[replayed] not in self.snapshots:
+            replayed -= 1
+
+        if replayed == 0:
+            self.m.restore(self.start)
+        else:
+            self.m.restore(self.snapshots[prefixes[replayed]])
+            self.snapshots.move_to_end(prefixes[replayed]) # type: ignore
+
+        if self.stats is not None:
+            self.stats.transitions += len(indexes) - replayed + 1
+        for k in range(replayed, len(indexes)):
+            self.m.transition(self.inputs[indexes[k]])
+            self.snapshots[prefixes[k + 1]] = self.m.snapshot()
+            if len(self.snapshots) > self.max_snapshots:
+                self.snapshots.popitem(last=False) # type: ignore
+        return self.m.transition(i)
+
+class OracleCache:
+    """A bounded cache of oracle results keyed by subtrace bitmask.
+
+    Bit j of a key is set if the subtrace contains the jth input of the trace.
+    A cache holds the results of a single wat query and must not be shared
+    between queries. Once the cache holds max_size results, the least recently
+    used result is evicted. hits and misses count the lookups that did and did
+    not find a result.
+    """
+    def __init__(self, max_size: int = 2**20) -> None:
+        assert max_size > 0, max_size
+        self.max_size = max_size
+        self.results: Dict[int, bool] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __str__(self) -> str:
+        return (f'OracleCache(size={len(self.results)}, hits={self.hits}, '
+                f'misses={self.misses})')
+
+    def __repr__(self) -> str:
+        return str(self)
+
+    def __contains__(self, mask: int) -> bool:
+        return mask in self.results
+
+    def get(self, mask: int) -> Optional[bool]:
+        result = self.results.get(mask)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.results.move_to_end(mask) # type: ignore
+        return result
+
+    def put(self, mask: int, result: bool) -> None:
+        self.results[mask] = result
+        self.results.move_to_end(mask) # type: ignore
+        if len(self.results) > self.max_size:
+            self.results.popitem(last=False) # type: ignore
+
+def _trace_satisfies_io(m: _Replayer[Input, Output],
+                        cache: OracleCache,
+                        trace: int,
                         io: Tuple[Input, Output]) \
                         -> bool:
+    result = cache.get(trace)
+    if result is None:
+        i, o = io
+        result = o == m.transition(trace, i)
+        cache.put(trace, result)
+        if m.stats is not None:
+            m.stats.replays += 1
+    if m.stats is not None:
+        m.stats.oracle_calls += 1
+    return result
+
+def _prefetch(m: _Replayer[Input, Output],
+              cache: OracleCache,
+              traces: List[int],
+              io: Tuple[Input, Output]) \
+              -> None:
+    """Caches whether every trace in traces satisfies io in one batch.
+
+    Does nothing if the state machine does not implement run_batch.
+    """
+    if not m.batched:
+        return
+    traces = [trace for trace in traces if trace not in cache]
+    if len(traces) == 0:
+        return
+
     i, o = io
-    m.run([i for (_, i, _) in trace])
-    return o == m.transition(i)
+    outputs = m.transition_batch(traces, i)
+    if outputs is None:
+        return
+    for trace, output in zip(traces, outputs):
+        cache.put(trace, o == output)
+    if m.stats is not None:
+        m.stats.replays += len(traces)
 
-def _subtrace_closed_under_superset(m: StateMachine[Input, Output],
-                                    subtrace: EnumeratedTrace,
-                                    trace: EnumeratedTrace,
+def _subtrace_closed_under_superset(m: _Replayer[Input, Output],
+                                    cache: OracleCache,
+                                    subtrace: int,
+                                    n: int,
                                     io: Tuple[Input, Output]) \
                                     -> bool:
-    return all(_trace_satisfies_io(m, supertrace, io) for
-               supertrace in _supertraces(subtrace, trace))
+    return all(_trace_satisfies_io(m, cache, supertrace, io) for
+               supertrace in _supertraces(subtrace, n))
 
-def _subtrace_is_witness(m: StateMachine[Input, Output],
-                         subtrace: EnumeratedTrace,
-                         trace: EnumeratedTrace,
+def _subtrace_is_witness(m: _Replayer[Input, Output],
+                         cache: OracleCache,
+                         subtrace: int,
+                         n: int,
                          io: Tuple[Input, Output]) \
                          -> bool:
-    if not _subtrace_closed_under_superset(m, subtrace, trace, io):
+    if not _subtrace_closed_under_superset(m, cache, subtrace, n, io):
         return False
 
     return all(subsubtrace == subtrace or
-               not _subtrace_closed_under_superset(m, subsubtrace, trace, io)
+               not _subtrace_closed_under_superset(m, cache, subsubtrace, n,
+                                                   io)
                for subsubtrace in _subtraces(subtrace))
 
-def _enumerated_wat(m: StateMachine[Input, Output],
-                    trace: EnumeratedTrace,
-                    io: Tuple[Input, Output]) \
-                    -> List[EnumeratedTrace]:
-    witnesses = [subtrace
-                 for subtrace in _subtraces(trace)
-                 if _subtrace_is_witness(m, subtrace, trace, io)]
+def _filter_happens_before(witnesses: List[int]) -> List[int]:
     return [witness
             for witness in witnesses
             if not any(w != witness and _trace_happens_before(witness, w)
                        for w in witnesses)]
 
+def _timed_filter_happens_before(stats: Optional[WatStats],
+                                 witnesses: List[int]) \
+                                 -> List[int]:
+    start = time.perf_counter()
+    witnesses = _filter_happens_before(witnesses)
+    if stats is not None:
+        stats.filter_seconds += time.perf_counter() - start
+    return witnesses
+
+def _enumerated_wat(m: _Replayer[Input, Output],
+                    cache: OracleCache,
+                    n: int,
+                    io: Tuple[Input, Output]) \
+                    -> List[int]:
+    # Every subtrace is replayed by the time the empty subtrace is found not to
+    # be a witness, so they can all be replayed in one batch.
+    _prefetch(m, cache, list(_powerset(n)), io)
+
+    witnesses: List[int] = []
+    for subtrace in _powerset(n):
+        if m.stats is not None:
+            m.stats.subtraces_enumerated += 1
+        if _subtrace_is_witness(m, cache, subtrace, n, io):
+            witnesses.append(subtrace)
+    witnesses.sort(key=_lexicographic_key)
+    return _timed_filter_happens_before(m.stats, witnesses)
+
+class _DeadlineExceeded(Exception):
+    pass
+
+def _minimal_closed_subtraces(m: _Replayer[Input, Output],
+                              cache: OracleCache,
+                              universe: int,
+                              io: Tuple[Input, Output],
+                              fixed: int = 0,
+                              base: int = 0,
+                              deadline: Optional[float] = None,
+                              copies: Optional[Dict[int, int]] = None) \
+                              -> Generator[int, None, None]:
+    """Yields the minimal subtraces of universe closed under superset.
+
+    Being closed under superset is monotone: if a subtrace is closed, so is
+    every subtrace containing it, and if it is not closed, neither is any
+    subtrace it contains. The witnesses are the minimal closed subtraces, so
+    we search the subtraces level by level, smallest first, as in Apriori.
+    Every subtrace that survives to a level has no closed proper subtrace, so
+    if it is closed, it is a witness, and we never extend it. Only the
+    subtraces that are not closed are extended to form the next level, and a
+    candidate is considered only if all of its subtraces one input smaller are
+    known not to be closed.
+
+    Whether a subtrace is closed is computed once and memoized. A subtrace is
+    closed if it satisfies io and every subtrace with one more input is
+    closed, so the check never materializes the set of supertraces. If the
+    state machine implements run_batch, every subtrace searched is replayed
+    in one batch if there are at most m.batch_size of them, and otherwise
+    every level is replayed in one batch.
+
+    Only the inputs in universe are searched. Every other input of the trace
+    must be irrelevant to io (see _slice), so that a subtrace satisfies io if
+    and only if its intersection with universe does.
+
+    If fixed is not 0, only the subtraces that agree with base on the bits in
+    fixed are searched, and they are minimal if no closed proper subtrace
+    agrees with base on fixed as well. This lets the search be split up by the
+    values of the bits in fixed.
+
+    If copies is not None, it maps inputs of universe to the copies before
+    them (see _copies), and only the canonical subtraces, which contain a
+    prefix of every run of copies, are searched. The minimal closed canonical
+    subtraces are yielded, and _expand_copies expands them into the minimal
+    closed subtraces. copies cannot be combined with fixed.
+
+    Subtraces are yielded as soon as they are found, smallest first. If
+    deadline, a time.time() value, passes, the search stops early and counts
+    towards m.stats.deadlines_exceeded.
+    """
+    assert copies is None or fixed == 0, 'copies cannot be combined with fixed.'
+    if copies is None:
+        copies = dict()
+    next_copies = {k: j for (j, k) in copies.items()}
+    closed: Dict[int, bool] = dict()
+
+    def canonical(subtrace: int, j: int) -> bool:
+        # Whether adding input j to canonical subtrace keeps it canonical.
+        return j not in copies or subtrace >> copies[j] & 1 == 1
+
+    def supertraces(subtrace: int) -> Iterator[int]:
+        for j in _indexes(universe & ~subtrace):
+            if canonical(subtrace, j):
+                yield subtrace | (1 << j)
+
+    def is_closed(subtrace: int) -> bool:
+        # A chain of supertraces can be as long as universe is large, so the
+        # supertraces are checked depth first with an explicit stack rather
+        # than recursively. A frame holds a subtrace, the iterator over its
+        # supertraces, and the supertrace being checked, if any.
+        stack: List[Tuple[int, Optional[Iterator[int]], Optional[int]]] = \
+            [(subtrace, None, None)]
+        while len(stack) > 0:
+            s, remaining, pending = stack.pop()
+            if s in closed:
+                continue
+            if remaining is None:
+                if deadline is not None and time.time() > deadline:
+                    raise _DeadlineExceeded()
+                if not _trace_satisfies_io(m, cache, s, io):
+                    closed[s] = False
+                    continue
+                remaining = supertraces(s)
+            elif pending is not None and not closed[pending]:
+                closed[s] = False
+                continue
+
+            for t in remaining:
+                if t not in closed:
+                    stack.append((s, remaining, t))
+                    stack.append((t, None, None))
+                    break
+                if not closed[t]:
+                    closed[s] = False
+                    break
+            else:
+                closed[s] = True
+        return closed[subtrace]
+
+    # Checking that a subtrace is closed replays every subtrace containing it,
+    # so if there are few enough subtraces, we replay them all in one batch.
+    free = universe & ~fixed
+    if m.batched and 1 << _popcount(free) <= m.batch_size:
+        _prefetch(m, cache,
+                  [base | s for s in _subtraces(free)
+                   if all(canonical(s, j) for j in _indexes(s))],
+                  io)
+
+    level: List[int] = [base]
+    while len(level) > 0:
+        if m.stats is not None:
+            m.stats.subtraces_enumerated += len(level)
+        _prefetch(m, cache, level, io)
+        unclosed: List[int] = []
+        for subtrace in level:
+            try:
+                subtrace_is_closed = is_closed(subtrace)
+            except _DeadlineExceeded:
+                if m.stats is not None:
+                    m.stats.deadlines_exceeded += 1
+                return
+            if subtrace_is_closed:
+                yield subtrace
+            else:
+                unclosed.append(subtrace)
+
+        # Every candidate extends its parent with an input after the parent's
+        # last input, so candidates are generated in lexicographic order and
+        # witnesses are found in the order _enumerated_wat returns them.
+        # Removing a copy whose next copy is in the candidate leaves a
+        # subtrace that is not canonical, but it is equivalent to removing the
+        # last copy of the run instead, so it need not be checked.
+        unclosed_set = set(unclosed)
+        level = []
+        for subtrace in unclosed:
+            later = ~((1 << (subtrace & ~fixed).bit_length()) - 1)
+            for j in _indexes(universe & ~fixed & later):
+                if not canonical(subtrace, j):
+                    continue
+                candidate = subtrace | (1 << j)
+                if all(candidate & ~(1 << k) in unclosed_set
+                       for k in _indexes(subtrace & ~fixed)
+                       if k not in next_copies or
+                       candidate >> next_copies[k] & 1 == 0):
+                    level.append(candidate)
+                elif m.stats is not None:
+                    m.stats.subtraces_pruned += 1
+
+def _spec_wat(m: StateMachine[Input, Output],
+              inputs: List[Input],
+              io: Tuple[Input, Output],
+              stats: Optional[WatStats]) \
+              -> Optional[List[int]]:
+    """Returns the witnesses computed by the spec for io, if one applies."""
+    i, o = io
+    spec_witnesses = spec_provenance(m, inputs, i, o)
+    if spec_witnesses is None:
+        return None
+    witnesses = [sum(1 << k for k in w) for w in spec_witnesses]
+    witnesses.sort(key=_lexicographic_key)
+    return _timed_filter_happens_before(stats, witnesses)
+
+def _levelwise_enumerated_wat(m: _Replayer[Input, Output],
+                              cache: OracleCache,
+                              universe: int,
+                              io: Tuple[Input, Output],
+                              copies: Optional[Dict[int, int]] = None) \
+                              -> List[int]:
+    witnesses = list(_minimal_closed_subtraces(m, cache, universe, io,
+                                               copies=copies))
+    if copies:
+        witnesses = [w for canonical in witnesses
+                     for w in _expand_copies(canonical, copies)]
+        witnesses.sort(key=_lexicographic_key)
+    return _timed_filter_happens_before(m.stats, witnesses)
+
+def _slice(m: StateMachine[Input, Output],
+           inputs: List[Input],
+           i: Input,
+           footprints: Optional[List[Optional[AbstractSet[Hashable]]]] = None) \
+           -> int:
+    """Returns the subtrace of the inputs that the output of i can depend on.
+
+    Walking backwards from i, an input is kept if its footprint overlaps the
+    footprints of i and of the inputs kept so far. Every other input only
+    touches state that nothing kept after it reads, so whether a subtrace
+    satisfies i's input/output pair never depends on them, and they never
+    appear in a witness.
+
+    If footprints is not None, it holds the footprints of the inputs, or of a
+    longer list of inputs that starts with them.
+    """
+    universe = (1 << len(inputs)) - 1
+    footprint = m.footprint(i)
+    if footprint is not None:
+        footprint = set(footprint)
+    for j in reversed(range(len(inputs))):
+        if footprint is None:
+            break
+        if footprints is None:
+            input_footprint = m.footprint(inputs[j])
+        else:
+            input_footprint = footprints[j]
+        if input_footprint is None:
+            footprint = None
+        elif input_footprint & footprint:
+            footprint |= input_footprint
+        else:
+            universe &= ~(1 << j)
+    return universe
+
+def _copies(m: StateMachine[Input, Output],
+            inputs: List[Input],
+            universe: int,
+            keys: Optional[List[Optional[Hashable]]] = None) \
+            -> Dict[int, int]:
+    """Returns the runs of interchangeable inputs in universe.
+
+    An input j copies an input k if they are interchangeable (see
+    StateMachine.symmetry_key) and no input of universe lies between them. The
+    inputs outside universe cannot affect the queried output (see _slice), so
+    a subtrace that contains one of j and k behaves the same whichever of the
+    two it contains. A subtrace then only matters up to how many inputs of
+    every run of copies it contains, and the search only considers the
+    canonical subtraces, which contain a prefix of every run.
+
+    Maps every copy to the input it copies. If keys is not None, it holds the
+    symmetry keys of the inputs, or of a longer list of inputs that starts
+    with them.
+    """
+    copies: Dict[int, int] = dict()
+    previous: Optional[int] = None
+    previous_key: Optional[Hashable] = None
+    for j in _indexes(universe):
+        key = m.symmetry_key(inputs[j]) if keys is None else keys[j]
+        if key is not None and previous is not None and key == previous_key:
+            copies[j] = previous
+        previous = j
+        previous_key = key
+    return copies
+
+def _expand_copies(witness: int, copies: Dict[int, int]) -> List[int]:
+    """Returns the subtraces equivalent to a canonical subtrace.
+
+    Every run of copies that witness contains some but not all of is replaced
+    by every choice of the same number of inputs from the run.
+    """
+    # runs maps the last input of every run to the run.
+    runs: Dict[int, List[int]] = dict()
+    for j in sorted(copies):
+        run = runs.pop(copies[j], [copies[j]])
+        run.append(j)
+        runs[j] = run
+
+    expanded = [witness]
+    for run in runs.values():
+        count = sum(witness >> k & 1 for k in run)
+        if count == 0 or count == len(run):
+            continue
+        run_mask = sum(1 << k for k in run)
+        expanded = [w & ~run_mask | sum(1 << k for k in chosen)
+                    for w in expanded
+                    for chosen in combinations(run, count)]
+    return expanded
+
+# The replayer, oracle cache, subtrace searched, and queried input/output pair
+# of a worker process in a parallel wat query, and whether to collect stats.
+_worker: Optional[Tuple[_Replayer, OracleCache, int, Tuple[Any, Any], bool]] \
+    = None
+
+def _init_worker(m: StateMachine[Input, Output],
+                 inputs: List[Input],
+                 universe: int,
+                 io: Tuple[Input, Output],
+                 cache_size: int,
+                 collect_stats: bool) \
+                 -> None:
+    global _worker
+    _worker = (_Replayer(m, inputs), OracleCache(cache_size), universe, io,
+               collect_stats)
+
+def _search_partition(fixed: int, base: int) \
+                      -> Tuple[List[int], int, int, Optional[WatStats]]:
+    assert _worker is not None
+    m, cache, universe, io, collect_stats = _worker
+    m.stats = WatStats() if collect_stats else None
+    hits = cache.hits
+    misses = cache.misses
+    witnesses = list(_minimal_closed_subtraces(m, cache, universe, io, fixed,
+                                               base))
+    return (witnesses, cache.hits - hits, cache.misses - misses, m.stats)
+
+def _parallel_enumerated_wat(m: StateMachine[Input, Output],
+                             cache: OracleCache,
+                             inputs: List[Input],
+                             universe: int,
+                             io: Tuple[Input, Output],
+                             workers: int,
+                             stats: Optional[WatStats]) \
+                             -> List[int]:
+    """Runs the level-wise search on a pool of worker processes.
+
+    The subtraces are partitioned by the values of their high-order bits, and
+    every worker searches whole partitions using its own copy of m and its own
+    OracleCache. A subtrace that is minimal within its partition is minimal
+    overall unless some other partition found a proper subtrace of it.
+    """
+    # A few partitions per worker keep the workers busy when some partitions
+    # take much longer to search than others.
+    bits = (4 * workers - 1).bit_length()
+    fixed = 0
+    for j in _indexes(universe)[-bits:]:
+        fixed |= 1 << j
+
+    candidates: List[int] = []
+    initargs = (m, inputs, universe, io, cache.max_size, stats is not None)
+    with ProcessPoolExecutor(workers,
+                             initializer=_init_worker,
+                             initargs=initargs) as pool:
+        futures = [pool.submit(_search_partition, fixed, base)
+                   for base in _subtraces(fixed)]
+        for future in futures:
+            witnesses, hits, misses, worker_stats = future.result()
+            candidates += witnesses
+            cache.hits += hits
+            cache.misses += misses
+            if stats is not None and worker_stats is not None:
+                stats.merge(worker_stats)
+
+    start = time.perf_counter()
+    minimal = [c for c in candidates
+               if not any(w != c and w & c == w for w in candidates)]
+    minimal.sort(key=_lexicographic_key)
+    if stats is not None:
+        stats.filter_seconds += time.perf_counter() - start
+    return _timed_filter_happens_before(stats, minimal)
+
 def wat(m: StateMachine[Input, Output],
         trace: Trace,
-        j: int) \
+        j: int,
+        levelwise: bool = True,
+        cache: Optional[OracleCache] = None,
+        workers: int = 1,
+        stats: Optional[WatStats] = None,
+        use_specs: bool = True,
+        result_cache: Optional[ResultCache] = None) \
         -> List[EnumeratedTrace]:
+    """Returns the wat provenance of the jth output of trace.
+
+    If use_specs is True and a provenance spec is registered for m and the jth
+    input, the witnesses are computed by the spec, and no subtrace is
+    replayed. Otherwise, or if the spec does not apply to trace, the witnesses
+    are searched for.
+
+    By default, the witnesses are found with a pruned level-wise search. If
+    levelwise is False, every subtrace is checked by brute force instead.
+
+    If workers is more than 1, the level-wise search is split across a pool of
+    that many processes, each with a pickled copy of m. The workers cache
+    oracle results themselves, and only their hit and miss counts are added
+    to cache.
+
+    Every subtrace replayed is cached in cache, so no subtrace is replayed
+    twice unless it has been evicted. If cache is None, a fresh OracleCache is
+    used. Pass in a fresh OracleCache to read its hit and miss counts after
+    the query.
+
+    Before the level-wise search, the trace is sliced down to the inputs that
+    the jth output can depend on, according to m's footprints. The sequential
+    level-wise search then treats every run of interchangeable inputs (see
+    StateMachine.symmetry_key) as a single input that can be repeated, and
+    expands the witnesses it finds back into every equivalent choice of
+    inputs from the runs.
+
+    If stats is not None, the work done by the query is added to it.
+
+    If result_cache is not None, the witnesses are looked up in it before they
+    are computed, and stored in it after.
+    """
+    start = time.perf_counter()
     enumerated_trace = _enumerate_trace(trace[:j])
     i, o = trace[j]
-    return _enumerated_wat(m, enumerated_trace, (i, o))
+    inputs = [i for (_, i, _) in enumerated_trace]
+    if cache is None:
+        cache = OracleCache()
+    assert workers >= 1, workers
+    assert levelwise or workers == 1, 'Only the level-wise search is parallel.'
+
+    if result_cache is not None:
+        cached = result_cache.get(m, trace, j)
+        if cached is not None:
+            if stats is not None:
+                stats.total_seconds += time.perf_counter() - start
+            return [[enumerated_trace[k] for k in w] for w in cached]
+
+    spec_witnesses = _spec_wat(m, inputs, (i, o), stats) if use_specs else None
+    if spec_witnesses is not None:
+        witnesses = spec_witnesses
+    elif workers > 1:
+        universe = _slice(m, inputs, i)
+        witnesses = _parallel_enumerated_wat(m, cache, inputs, universe, (i, o),
+                                             workers, stats)
+    elif levelwise:
+        universe = _slice(m, inputs, i)
+        copies = _copies(m, inputs, universe)
+        replayer = _Replayer(m, inputs, stats=stats)
+        witnesses = _levelwise_enumerated_wat(replayer, cache, universe, (i, o),
+                                              copies)
+    else:
+        replayer = _Replayer(m, inputs, stats=stats)
+        witnesses = _enumerated_wat(replayer, cache, j, (i, o))
+    if result_cache is not None:
+        result_cache.put(m, trace, j, [_indexes(w) for w in witnesses])
+    if stats is not None:
+        stats.total_seconds += time.perf_counter() - start
+    return [_subtrace(enumerated_trace, w) for w in witnesses]
+
+def verify_spec(m: StateMachine[Input, Output], trace: Trace, j: int) \
+                -> Optional[bool]:
+    """Returns whether the spec for the jth output of trace is correct.
+
+    The witnesses computed by the spec are compared to the witnesses found by
+    the level-wise search. Returns None if no spec applies to the jth output.
+    """
+    inputs = [i for (i, _) in trace[:j]]
+    i, o = trace[j]
+    if spec_provenance(m, inputs, i, o) is None:
+        return None
+    return (wat(m, trace, j, use_specs=True) ==
+            wat(m, trace, j, use_specs=False))
+
+def iter_wat(m: StateMachine[Input, Output],
+             trace: Trace,
+             j: int,
+             max_witnesses: Optional[int] = None,
+             deadline: Optional[float] = None,
+             cache: Optional[OracleCache] = None,
+             stats: Optional[WatStats] = None) \
+             -> Generator[EnumeratedTrace, None, None]:
+    """Yields the witnesses of the jth output of trace as they are found.
+
+    Witnesses are found by the level-wise search and yielded smallest first.
+    At most max_witnesses witnesses are yielded, and no more are yielded once
+    deadline, a time.time() value, has passed. If the search is cut short by
+    the deadline, stats.deadlines_exceeded is incremented, so the caller can
+    tell whether every witness was yielded.
+
+    wat drops every witness that happens before another witness, but that can
+    only be decided once every witness is known. iter_wat defers this filter:
+    it yields every minimal witness, including the ones wat would drop.
+
+    If stats is not None, the work done by the query is added to it. Only the
+    time spent finding witnesses counts towards total_seconds, not the time
+    the caller spends between them.
+    """
+    start = time.perf_counter()
+    enumerated_trace = _enumerate_trace(trace[:j])
+    i, o = trace[j]
+    inputs = [i for (_, i, _) in enumerated_trace]
+    replayer = _Replayer(m, inputs, stats=stats)
+    if cache is None:
+        cache = OracleCache()
+
+    universe = _slice(m, inputs, i)
+    copies = _copies(m, inputs, universe)
+    witnesses = (w
+                 for canonical in _minimal_closed_subtraces(replayer, cache,
+                                                            universe, (i, o),
+                                                            deadline=deadline,
+                                                            copies=copies)
+                 for w in _expand_copies(canonical, copies))
+    for witness in islice(witnesses, max_witnesses):
+        if stats is not None:
+            stats.total_seconds += time.perf_counter() - start
+        yield _subtrace(enumerated_trace, witness)
+        start = time.perf_counter()
+    if stats is not None:
+        stats.total_seconds += time.perf_counter() - start
+
+def _query_key(j: int, io: Tuple[Input, Output]) -> Hashable:
+    """Returns a key shared by queries that can share oracle results.
+
+    Whether a subtrace satisfies io does not depend on which output of the
+    trace io is, so queries of equal input/output pairs can share an
+    OracleCache. Pairs that are not hashable are only shared by queries of the
+    same output. Inputs and outputs are often NamedTuples, which compare equal
+    to tuples of other types with the same fields, so their types are part of
+    the key.
+    """
+    i, o = io
+    try:
+        hash(io)
+        return (type(i), type(o), io)
+    except TypeError:
+        return j
+
+def wat_many(m: StateMachine[Input, Output],
+             trace: Trace,
+             js: List[int],
+             stats: Optional[WatStats] = None) \
+             -> Dict[int, List[EnumeratedTrace]]:
+    """Returns the wat provenance of the jth output of trace for every j in js.
+
+    The queries are answered in order of j by the level-wise search, sharing a
+    single replayer, so a prefix of the trace replayed for one query is not
+    replayed again for the next. Queries with equal input/output pairs also
+    share an OracleCache.
+
+    If stats is not None, the work done by the queries is added to it.
+    """
+    if len(js) == 0:
+        return dict()
+
+    start = time.perf_counter()
+    enumerated_trace = _enumerate_trace(trace[:max(js)])
+    inputs = [i for (_, i, _) in enumerated_trace]
+    replayer = _Replayer(m, inputs, stats=stats)
+    caches: Dict[Hashable, OracleCache] = dict()
+    provenance: Dict[int, List[EnumeratedTrace]] = dict()
+    for j in sorted(set(js)):
+        i, o = trace[j]
+        key = _query_key(j, (i, o))
+        if key not in caches:
+            caches[key] = OracleCache()
+        universe = _slice(m, inputs[:j], i)
+        copies = _copies(m, inputs, universe)
+        witnesses = _levelwise_enumerated_wat(replayer, caches[key], universe,
+                                              (i, o), copies)
+        provenance[j] = [_subtrace(enumerated_trace, w) for w in witnesses]
+    if stats is not None:
+        stats.total_seconds += time.perf_counter() - start
+    return provenance
+
+class IncrementalWat(Generic[Input, Output]):
+    """Tracks the provenance of a trace that grows one input at a time.
+
+    append transitions m on an input and records the input/output pair in
+    trace. wat returns the provenance of an output of trace, the newest by
+    default. The queries share a replayer, so the snapshots taken while
+    replaying for one query are reused by the next, and queries with equal
+    input/output pairs share an OracleCache (see wat_many). The footprint and
+    symmetry key of every input are computed once, when it is appended, and
+    the provenance of an output never changes as the trace grows, so it is
+    computed only once.
+
+    If m implements snapshot, the state after the whole trace is kept, so
+    appending an input takes a single transition. Otherwise, the trace is
+    replayed whenever a query has moved m away from it.
+    """
+    def __init__(self,
+                 m: StateMachine[Input, Output],
+                 use_specs: bool = True,
+                 stats: Optional[WatStats] = None) -> None:
+        self.m = m
+        self.use_specs = use_specs
+        self.stats = stats
+        self.trace: Trace = []
+        self.inputs: List[Input] = []
+        self.footprints: List[Optional[AbstractSet[Hashable]]] = []
+        self.symmetry_keys: List[Optional[Hashable]] = []
+        self.replayer = _Replayer(m, self.inputs, stats=stats)
+        self.caches: Dict[Hashable, OracleCache] = dict()
+        self.provenance: Dict[int, List[EnumeratedTrace]] = dict()
+        self.head: Optional[Any] = self.replayer.start
+        self.at_head = True
+
+    def append(self, i: Input) -> Output:
+        """Transitions on i after the trace so far and returns the output."""
+        if self.head is not None:
+            self.m.restore(self.head)
+        elif not self.at_head:
+            self.m.run(self.inputs)
+
+        o = self.m.transition(i)
+        if self.head is not None:
+            self.head = self.m.snapshot()
+        self.at_head = True
+
+        self.trace.append((i, o))
+        self.inputs.append(i)
+        footprint = self.m.footprint(i)
+        self.footprints.append(None if footprint is None else set(footprint))
+        self.symmetry_keys.append(self.m.symmetry_key(i))
+        return o
+
+    def wat(self, j: Optional[int] = None) -> List[EnumeratedTrace]:
+        """Returns the wat provenance of the jth output, the newest if None."""
+        if j is None:
+            j = len(self.trace) - 1
+        assert 0 <= j < len(self.trace), (j, len(self.trace))
+        if j in self.provenance:
+            return self.provenance[j]
+
+        start = time.perf_counter()
+        enumerated_trace = _enumerate_trace(self.trace[:j])
+        i, o = self.trace[j]
+        inputs = self.inputs[:j]
+        witnesses = None
+        if self.use_specs:
+            witnesses = _spec_wat(self.m, inputs, (i, o), self.stats)
+        if witnesses is None:
+            key = _query_key(j, (i, o))
+            if key not in self.caches:
+                self.caches[key] = OracleCache()
+            universe = _slice(self.m, inputs, i, self.footprints)
+            copies = _copies(self.m, inputs, universe, self.symmetry_keys)
+            self.at_head = False
+            witnesses = _levelwise_enumerated_wat(self.replayer,
+                                                  self.caches[key], universe,
+                                                  (i, o), copies)
+
+        provenance = [_subtrace(enumerated_trace, w) for w in witnesses]
+        self.provenance[j] = provenance
+        if self.stats is not None:
+            self.stats.total_seconds += time.perf_counter() - start
+        return provenance
+
+def _ddmin(inputs: List[int], test: Callable[[List[int]], bool]) -> List[int]:
+    """Shrinks inputs, which pass test, to a 1-minimal list that passes test.
+
+    This is Zeller and Hildebrandt's ddmin: inputs is split into chunks, and
+    we keep any chunk or complement of a chunk that passes test, splitting
+    into finer chunks whenever none does. As in ddmin, the empty list is
+    assumed to fail test and is never tested.
+    """
+    n = 2
+    while len(inputs) >= 2:
+        size = len(inputs) / n
+        chunks = [inputs[int(k * size):int((k + 1) * size)] for k in range(n)]
+        complements = [inputs[:int(k * size)] + inputs[int((k + 1) * size):]
+                       for k in range(n)]
+
+        chunk = next((c for c in chunks if test(c)), None)
+        if chunk is not None:
+            inputs = chunk
+            n = 2
+            continue
+
+        complement = next((c for c in complements if test(c)), None)
+        if complement is not None:
+            inputs = complement
+            n = max(n - 1, 2)
+            continue
+
+        if n >= len(inputs):
+            break
+        n = min(2 * n, len(inputs))
+    return inputs
+
+class WatOneResult(NamedTuple):
+    witness: EnumeratedTrace
+    replays: int
+    minimal: bool
+    verified: bool
+
+def wat_one(m: StateMachine[Input, Output],
+            trace: Trace,
+            j: int,
+            cache: Optional[OracleCache] = None,
+            stats: Optional[WatStats] = None,
+            verify_limit: int = 1 << 12) \
+            -> WatOneResult:
+    """Returns a single witness of the jth output of trace, found by ddmin.
+
+    The sliced prefix of the trace is always closed under superset, and we
+    shrink it with ddmin. Checking that a subtrace is closed under superset
+    takes exponentially many replays, so ddmin instead checks that the jth
+    input/output pair is satisfied by the subtrace, by the subtrace plus any
+    one more input, and by the sliced prefix minus any one input not in the
+    subtrace. This takes polynomially many replays, but the witness is only
+    guaranteed to be closed under those supertraces, not under all of them.
+
+    The witness is then checked exactly if it has at most verify_limit / 2
+    supertraces, and if it is not closed under all of them, the sliced prefix
+    replaces it. Any closed subtrace with one input fewer then replaces the
+    witness until there is none or the check grows too big. Along with the
+    witness, we return the number of subtraces replayed, whether the witness
+    was verified to be closed, and whether it was verified to be minimal,
+    meaning it is one of the minimal closed subtraces wat searches for.
+
+    If stats is not None, the work done by the query is added to it. Every
+    subtrace ddmin checks counts as an enumerated subtrace.
+    """
+    start = time.perf_counter()
+    enumerated_trace = _enumerate_trace(trace[:j])
+    i, o = trace[j]
+    inputs = [i for (_, i, _) in enumerated_trace]
+    replayer = _Replayer(m, inputs, stats=stats)
+    if cache is None:
+        cache = OracleCache()
+    misses = cache.misses
+
+    universe = _slice(m, inputs, i)
+
+    def locally_closed(indexes: List[int]) -> bool:
+        if stats is not None:
+            stats.subtraces_enumerated += 1
+        subtrace = sum(1 << k for k in indexes)
+        return (_trace_satisfies_io(replayer, cache, subtrace, (i, o)) and
+                all(_trace_satisfies_io(replayer, cache,
+                                        subtrace | (1 << k), (i, o)) and
+                    _trace_satisfies_io(replayer, cache,
+                                        universe & ~(1 << k), (i, o))
+                    for k in _indexes(universe & ~subtrace)))
+
+    def closed(subtrace: int) -> bool:
+        if stats is not None:
+            stats.subtraces_enumerated += 1
+        return all(_trace_satisfies_io(replayer, cache, subtrace | extra,
+                                       (i, o))
+                   for extra in _subtraces(universe & ~subtrace))
+
+    def checkable(subtrace: int) -> bool:
+        # Checking the subtraces with one input fewer replays up to twice as
+        # many supertraces as checking subtrace itself.
+        return 1 << (_popcount(universe & ~subtrace) + 1) <= verify_limit
+
+    witness = sum(1 << k for k in _ddmin(_indexes(universe), locally_closed))
+    if checkable(witness) and not closed(witness):
+        # The sliced prefix is always closed, so we shrink it instead.
+        witness = universe
+    verified = checkable(witness)
+    minimal = False
+    while verified and checkable(witness):
+        smaller = next((witness & ~(1 << k) for k in _indexes(witness)
+                        if closed(witness & ~(1 << k))), None)
+        if smaller is None:
+            minimal = True
+            break
+        witness = smaller
+    if stats is not None:
+        stats.total_seconds += time.perf_counter() - start
+    return WatOneResult(_subtrace(enumerated_trace, witness),
+                        cache.misses - misses,
+                        minimal,
+                        verified)
@@ -0,0 +1,260 @@
+from typing import Any, Callable, List, Tuple
+import random
+import unittest
+
+from .bexpr import And, Bexpr, Expr, Not, Or, Var
+from .db import Db, DbCross, DbCup, DbDiff, DbProject, DbRelation
+from .kvs import Kvs
+from .lists import Lists
+from .state_machine import StateMachine
+from .stats import WatStats
+from .wat import (IncrementalWat, Trace, _filter_happens_before, _indexes,
+                  _lexicographic_key, _popcount, iter_wat, wat, wat_many,
+                  wat_one)
+
+# Every trace generator takes a source of randomness and a number of inputs
+# and returns a state machine and a trace of it whose last output is queried.
+Generator = Callable[[random.Random, int], Tuple[StateMachine, Trace]]
+
+def kvs_trace(rand: random.Random, n: int) -> Tuple[StateMachine, Trace]:
+    m = Kvs()
+    inputs: List[Any] = []
+    for _ in range(n):
+        k = rand.choice('xy')
+        op = rand.randrange(3)
+        if op == 0:
+            inputs.append(m.set(k, rand.randrange(2)))
+        elif op == 1:
+            inputs.append(m.add(k, rand.randrange(-1, 2)))
+        else:
+            inputs.append(m.get(k))
+    inputs.append(m.get(rand.choice('xy')))
+    return (m, m.run(inputs))
+
+def lists_trace(rand: random.Random, n: int) -> Tuple[StateMachine, Trace]:
+    m = Lists()
+    inputs: List[Any] = []
+    for _ in range(n):
+        x = rand.choice('ab')
+        inputs.append(rand.choice([m.lpush(x), m.rpush(x), m.lpop(), m.rpop(),
+                                   m.remove(x), m.index(rand.randrange(2))]))
+    inputs.append(rand.choice([m.index(rand.randrange(2)), m.lpop(),
+                               m.rpop()]))
+    return (m, m.run(inputs))
+
+def random_expr(rand: random.Random, depth: int) -> Expr:
+    r = rand.random()
+    if depth == 0 or r < 0.3:
+        return Var(rand.choice('abc'))
+    elif r < 0.6:
+        return And([random_expr(rand, depth - 1) for _ in range(2)])
+    elif r < 0.9:
+        return Or([random_expr(rand, depth - 1) for _ in range(2)])
+    else:
+        return Not(random_expr(rand, depth - 1))
+
+def bexpr_trace(rand: random.Random, n: int) -> Tuple[StateMachine, Trace]:
+    m = Bexpr()
+    inputs: List[Any] = []
+    for _ in range(n):
+        r = rand.random()
+        if r < 0.4:
+            inputs.append(m.set(rand.choice('abc')))
+        elif r < 0.8:
+            inputs.append(m.unset(rand.choice('abc')))
+        else:
+            inputs.append(m.eval(random_expr(rand, 2)))
+    inputs.append(m.eval(random_expr(rand, 2)))
+    return (m, m.run(inputs))
+
+def db_trace(rand: random.Random, n: int) -> Tuple[StateMachine, Trace]:
+    m = Db()
+    inputs: List[Any] = [m.create('R', 1), m.create('S', 1)]
+    for _ in range(n):
+        inputs.append(m.insert(rand.choice('RS'), [rand.choice('ab')]))
+    r = DbRelation('R')
+    s = DbRelation('S')
+    inputs.append(m.query(rand.choice([DbDiff(r, s), DbCup(r, s),
+                                       DbProject(DbCross(r, s), [0])])))
+    return (m, m.run(inputs))
+
+GENERATORS: List[Generator] = [kvs_trace, lists_trace, bexpr_trace, db_trace]
+
+def random_traces(seed: int, count: int, max_length: int) \
+                  -> List[Tuple[StateMachine, Trace]]:
+    rand = random.Random(seed)
+    return [GENERATORS[k % len(GENERATORS)](rand,
+                                            rand.randrange(max_length + 1))
+            for k in range(count)]
+
+def minimal_closed_subtraces(m: StateMachine, trace: Trace, j: int) \
+                             -> List[int]:
+    """Returns the minimal subtraces of trace[:j] closed under superset.
+
+    This follows the definition of wat provenance directly, replaying every
+    subtrace from the start state, so that the search can be checked against
+    it.
+    """
+    inputs = [i for (i, _) in trace[:j]]
+    i, o = trace[j]
+    satisfies = []
+    for mask in range(1 << j):
+        m.run([inputs[k] for k in _indexes(mask)])
+        satisfies.append(m.transition(i) == o)
+    closed = [all(satisfies[mask | extra] for extra in range(1 << j)
+                  if extra & mask == 0)
+              for mask in range(1 << j)]
+    witnesses = [mask for mask in range(1 << j)
+                 if closed[mask] and
+                 not any(closed[mask & ~(1 << k)] for k in _indexes(mask))]
+    witnesses.sort(key=_lexicographic_key)
+    return witnesses
+
+def brute_force_wat(m: StateMachine, trace: Trace, j: int) -> List[List[int]]:
+    witnesses = minimal_closed_subtraces(m, trace, j)
+    return [_indexes(w) for w in _filter_happens_before(witnesses)]
+
+def indexes(provenance: List[List[Tuple[int, Any, Any]]]) -> List[List[int]]:
+    return [[k for (k, _, _) in witness] for witness in provenance]
+
+class WatTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.traces = random_traces(0, 200, 7)
+
+    def assert_matches_brute_force(self,
+                                   query: Callable[[StateMachine, Trace, int],
+                                                   List[List[int]]]) \
+                                   -> None:
+        for m, trace in self.traces:
+            j = len(trace) - 1
+            expected = brute_force_wat(type(m)(), trace, j)
+            self.assertEqual(query(type(m)(), trace, j), expected, trace)
+
+    def test_wat(self) -> None:
+        # The level-wise search slices the trace and searches runs of equal
+        # inputs as one.
+        self.assert_matches_brute_force(
+            lambda m, trace, j: indexes(wat(m, trace, j, use_specs=False)))
+
+    def test_wat_with_specs(self) -> None:
+        self.assert_matches_brute_force(
+            lambda m, trace, j: indexes(wat(m, trace, j)))
+
+    def test_enumerated_wat(self) -> None:
+        self.assert_matches_brute_force(
+            lambda m, trace, j: indexes(wat(m, trace, j, levelwise=False,
+                                            use_specs=False)))
+
+    def test_parallel_wat(self) -> None:
+        for m, trace in random_traces(1, 8, 9):
+            j = len(trace) - 1
+            expected = brute_force_wat(type(m)(), trace, j)
+            stats = WatStats()
+            provenance = wat(type(m)(), trace, j, workers=2, use_specs=False,
+                             stats=stats)
+            self.assertEqual(indexes(provenance), expected, trace)
+            self.assertGreater(stats.oracle_calls, 0)
+
+    def test_iter_wat(self) -> None:
+        # iter_wat yields every minimal closed subtrace, smallest first, and
+        # leaves filtering the ones that happen before another to the caller.
+        for m, trace in self.traces:
+            j = len(trace) - 1
+            expected = minimal_closed_subtraces(type(m)(), trace, j)
+            masks = [sum(1 << k for k in w)
+                     for w in indexes(list(iter_wat(type(m)(), trace, j)))]
+            self.assertEqual(sorted(masks, key=_lexicographic_key), expected,
+                             trace)
+            self.assertEqual([_popcount(w) for w in masks],
+                             sorted(_popcount(w) for w in masks))
+
+    def test_wat_many(self) -> None:
+        for m, trace in self.traces[:50]:
+            js = list(range(len(trace)))
+            provenance = wat_many(type(m)(), trace, js)
+            for j in js:
+                self.assertEqual(indexes(provenance[j]),
+                                 brute_force_wat(type(m)(), trace, j),
+                                 (trace, j))
+
+    def test_incremental_wat(self) -> None:
+        for m, trace in self.traces[:50]:
+            incremental = IncrementalWat(type(m)(), use_specs=False)
+            for j, (i, o) in enumerate(trace):
+                self.assertEqual(incremental.append(i), o)
+                # Query some outputs after later inputs have been appended.
+                for k in range(j // 2, j + 1):
+                    self.assertEqual(indexes(incremental.wat(k)),
+                                     brute_force_wat(type(m)(), trace, k),
+                                     (trace, k))
+
+    def test_wat_one(self) -> None:
+        # ddmin's check is approximate, so wat_one is checked on more and
+        # longer traces than the other queries.
+        for m, trace in random_traces(1, 300, 8):
+            j = len(trace) - 1
+            expected = minimal_closed_subtraces(type(m)(), trace, j)
+            result = wat_one(type(m)(), trace, j)
+            witness = sum(1 << k for k in indexes([result.witness])[0])
+            if result.verified:
+                self.assertTrue(any(w & witness == w for w in expected),
+                                (trace, result))
+            if result.minimal:
+                self.assertIn(witness, expected, (trace, result))
+            # Small traces are always checked exactly.
+            self.assertTrue(result.verified and result.minimal,
+                            (trace, result))
+
+    def test_wat_one_is_not_fooled_by_local_closure(self) -> None:
+        # Every subtrace plus one input satisfies the query, as does the
+        # trace minus any one input, but the empty subtrace is not closed.
+        m = Lists()
+        trace = m.run([m.lpush('x0'), m.remove('x1'), m.lpop(), m.rpop(),
+                       m.remove('x0'), m.lpop(), m.rpop(), m.rpush('x0'),
+                       m.index(1)])
+        result = wat_one(Lists(), trace, 8)
+        self.assertTrue(result.minimal)
+        self.assertIn(indexes([result.witness])[0], [[2], [6]])
+        self.assertEqual(indexes(wat(Lists(), trace, 8, use_specs=False)),
+                         [[6]])
+
+    # A chain of supertraces is as long as the trace, so checking that a
+    # subtrace is closed must not recurse once per input.
+    def test_long_kvs_trace(self) -> None:
+        n = 500
+        m = Kvs()
+        inputs: List[Any] = [m.set('x', 1)] * n + [m.get('x')]
+        trace = m.run(inputs)
+        self.assertEqual(indexes(wat(m, trace, n, use_specs=False)),
+                         [[n - 1]])
+
+    def test_long_lists_trace(self) -> None:
+        n = 500
+        m = Lists()
+        inputs: List[Any] = [m.rpush('a')] * n + [m.index(0)]
+        trace = m.run(inputs)
+        self.assertEqual(indexes(wat(m, trace, n, use_specs=False)),
+                         [[n - 1]])
+
+class RunBatchTest(unittest.TestCase):
+    def test_run_batch(self) -> None:
+        # run_batch must agree with replaying every subtrace one input at a
+        # time, and must not change the current state.
+        for m, trace in random_traces(2, 100, 7):
+            if type(m) not in (Kvs, Bexpr):
+                continue
+            inputs = [i for (i, _) in trace[:-1]]
+            i, o = trace[-1]
+            masks = list(range(1 << len(inputs)))
+            m.run(inputs)
+            outputs = m.run_batch(inputs, masks, i)
+            self.assertEqual(m.transition(i), o)
+
+            expected = []
+            for mask in masks:
+                m.run([inputs[k] for k in _indexes(mask)])
+                expected.append(m.transition(i))
+            self.assertEqual(outputs, expected, trace)
+
+if __name__ == '__main__':
+    unittest.main()
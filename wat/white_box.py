@@ -1,7 +1,11 @@
-from typing import (Callable, Dict, List, NamedTuple, FrozenSet, Optional, Set,
-                    Tuple, Union)
+from collections import Counter
+from typing import (AbstractSet, Any, Callable, Dict, Hashable, Iterable,
+                    Iterator, List, NamedTuple, Optional, Set, Tuple, Union)
+import time
 
+from .persistent import CowDict, CowSet, PersistentSet
 from .state_machine import StateMachine
+from .stats import WhiteBoxStats
 
 # Types ########################################################################
 # TODO: Document.
@@ -20,23 +24,135 @@ Record = Tuple[str, ...]
 class TimestampedRecord(NamedTuple):
     record: Record
     timestamp: Timestamp
+    id: int
 
 class RecordId(NamedTuple):
     relation_name: str
     record: Record
     timestamp: Timestamp
 
+# Every timestamped record is interned as an int id, which lineage refers to
+# it by. The ids of a tick's records are numbered from tick << _ID_BITS, and
+# the first, with a step of 0, is the tick's request. An id thus encodes its
+# tick and whether it is a request, and no table of ids needs to be kept.
+_ID_BITS = 32
+
+def _first_id(tick: int) -> int:
+    return tick << _ID_BITS
+
+def _id_tick(id: int) -> int:
+    return id >> _ID_BITS
+
+def _is_request_id(id: int) -> bool:
+    return id & ((1 << _ID_BITS) - 1) == 0
+
 RelationName = str
-Relation = Set[TimestampedRecord]
+Columns = Tuple[int, ...]
+_NO_RECORDS: PersistentSet[TimestampedRecord] = PersistentSet()
+
+_Index = CowDict[Record, PersistentSet[TimestampedRecord]]
+
+class Relation:
+    """A set of timestamped records with hash indexes on some columns.
+
+    An index on columns maps the values of the columns to the records with
+    those values, and is kept up to date as records are added and discarded,
+    so lookup finds them in constant time. The records and indexes are
+    persistent (see persistent.py), so copying a relation takes O(1) time.
+    """
+    def __init__(self,
+                 records: Iterable[TimestampedRecord] = (),
+                 indexes: Iterable[Columns] = ()) -> None:
+        self.records: CowSet[TimestampedRecord] = CowSet()
+        self.indexes: Dict[Columns, _Index] = \
+            {tuple(columns): CowDict() for columns in indexes}
+        for tr in records:
+            self.add(tr)
+
+    def copy(self) -> 'Relation':
+        relation = Relation()
+        relation.records = self.records.copy()
+        relation.indexes = {columns: index.copy()
+                            for (columns, index) in self.indexes.items()}
+        return relation
+
+    def has_index(self, columns: Columns) -> bool:
+        return columns in self.indexes
+
+    def lookup(self, columns: Columns, key: Record) \
+               -> AbstractSet[TimestampedRecord]:
+        """Returns the records whose values in columns are key."""
+        return self.indexes[columns].get(key, _NO_RECORDS)
+
+    def add(self, tr: TimestampedRecord) -> None:
+        if tr in self.records:
+            return
+        self.records.add(tr)
+        for columns, index in self.indexes.items():
+            key = tuple(tr.record[i] for i in columns)
+            index[key] = index.get(key, _NO_RECORDS).add(tr)
+
+    def discard(self, tr: TimestampedRecord) -> None:
+        if tr not in self.records:
+            return
+        self.records.discard(tr)
+        for columns, index in self.indexes.items():
+            key = tuple(tr.record[i] for i in columns)
+            trs = index[key].discard(tr)
+            if len(trs) == 0:
+                del index[key]
+            else:
+                index[key] = trs
+
+    def clear(self) -> None:
+        self.records = CowSet()
+        self.indexes = {columns: CowDict() for columns in self.indexes}
+
+    def __contains__(self, tr: Any) -> bool:
+        return tr in self.records
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __iter__(self) -> Iterator[TimestampedRecord]:
+        return iter(self.records)
+
+    def __str__(self) -> str:
+        return f'Relation({self.records})'
+
+    def __repr__(self) -> str:
+        return str(self)
+
 Arity = int
 Schema = Dict[RelationName, Arity]
 Database = Dict[RelationName, Relation]
-Lineage = Set[FrozenSet[RecordId]]
+# A witness is a sorted tuple of distinct record ids.
+Witness = Tuple[int, ...]
+Lineage = Set[Witness]
+
+def _union(lhs: Witness, rhs: Witness) -> Witness:
+    if len(lhs) == 0:
+        return rhs
+    if len(rhs) == 0:
+        return lhs
+    # Witnesses usually join records of different ticks, and can then be
+    # concatenated.
+    if lhs[-1] < rhs[0]:
+        return lhs + rhs
+    if rhs[-1] < lhs[0]:
+        return rhs + lhs
+    return tuple(sorted(set(lhs).union(rhs)))
 
 
 # Queries ######################################################################
 # Every output tuple is annotated with its witness.
-WbQueryOutput = Set[Tuple[Record, FrozenSet[RecordId]]]
+WbQueryOutput = Set[Tuple[Record, Witness]]
+
+# A query can contain the same subquery more than once, like kvs in
+# kvs - (kvs * set_req). Every subquery's result is memoized by its key while
+# the query is evaluated, so equal subqueries are only evaluated once. The
+# memoized results are shared, so they must not be modified.
+Memo = Dict[Hashable, WbQueryOutput]
 Coercible = Union[str, Record, 'WbQuery']
 
 def coerce(coercible: Coercible) -> 'WbQuery':
@@ -50,7 +166,19 @@ def coerce(coercible: Coercible) -> 'WbQuery':
         raise ValueError(f'Unexpected coercible "{coercible}".')
 
 class WbQuery:
-    def eval(self, db: Database) -> WbQueryOutput:
+    def eval(self, db: Database, memo: Optional[Memo] = None) -> WbQueryOutput:
+        if memo is None:
+            memo = dict()
+        key = self.key()
+        if key not in memo:
+            memo[key] = self._eval(db, memo)
+        return memo[key]
+
+    def _eval(self, db: Database, memo: Memo) -> WbQueryOutput:
+        raise NotImplementedError()
+
+    def key(self) -> Hashable:
+        """Returns a key shared by the queries equal to this one."""
         raise NotImplementedError()
 
     def __add__(self, other: Coercible) -> 'WbCup':
@@ -77,12 +205,24 @@ class WbQuery:
     def project(self, indexes: List[int]) -> 'WbProject':
         return WbProject(self, indexes)
 
+    def join(self,
+             other: Coercible,
+             lhs_columns: List[int],
+             rhs_columns: List[int]) \
+             -> 'WbJoin':
+        return WbJoin(self, coerce(other), lhs_columns, rhs_columns)
+
 class WbRecord(WbQuery):
     def __init__(self, record: Record) -> None:
         self.record = record
 
-    def eval(self, db: Database) -> WbQueryOutput:
-        return {(self.record, frozenset())}
+    # override.
+    def _eval(self, db: Database, memo: Memo) -> WbQueryOutput:
+        return {(self.record, ())}
+
+    # override.
+    def key(self) -> Hashable:
+        return ('record', self.record)
 
     def __str__(self) -> str:
         return f'{self.record}'
@@ -94,10 +234,14 @@ class WbRelation(WbQuery):
     def __init__(self, R: RelationName) -> None:
         self.R = R
 
-    def eval(self, db: Database) -> WbQueryOutput:
+    # override.
+    def _eval(self, db: Database, memo: Memo) -> WbQueryOutput:
         assert self.R in db, (self.R, db)
-        return {(r, frozenset([RecordId(self.R, r, t)]))
-                for (r, t) in db[self.R]}
+        return {(tr.record, (tr.id,)) for tr in db[self.R]}
+
+    # override.
+    def key(self) -> Hashable:
+        return ('relation', self.R)
 
     def __str__(self) -> str:
         return f'{self.R}'
@@ -110,8 +254,15 @@ class WbSelect(WbQuery):
         self.child = coerce(child)
         self.f = f
 
-    def eval(self, db: Database) -> WbQueryOutput:
-        return {(r, lineage) for r, lineage in self.child.eval(db) if self.f(r)}
+    # override.
+    def _eval(self, db: Database, memo: Memo) -> WbQueryOutput:
+        return {(r, lineage)
+                for r, lineage in self.child.eval(db, memo)
+                if self.f(r)}
+
+    # override.
+    def key(self) -> Hashable:
+        return ('select', self.child.key(), self.f)
 
     def __str__(self) -> str:
         return f'Select({self.child}, {self.f})'
@@ -124,9 +275,14 @@ class WbProject(WbQuery):
         self.child = coerce(child)
         self.indexes = indexes
 
-    def eval(self, db: Database) -> WbQueryOutput:
+    # override.
+    def _eval(self, db: Database, memo: Memo) -> WbQueryOutput:
         return {(tuple(r[i] for i in self.indexes), lineage)
-                 for r, lineage in self.child.eval(db)}
+                 for r, lineage in self.child.eval(db, memo)}
+
+    # override.
+    def key(self) -> Hashable:
+        return ('project', self.child.key(), tuple(self.indexes))
 
     def __str__(self) -> str:
         return f'Project({self.child}, {self.indexes})'
@@ -139,10 +295,19 @@ class WbCross(WbQuery):
         self.lhs = coerce(lhs)
         self.rhs = coerce(rhs)
 
-    def eval(self, db: Database) -> WbQueryOutput:
-        return {(lhs_r + rhs_r, lhs_lineage | rhs_lineage)
-                for (lhs_r, lhs_lineage) in self.lhs.eval(db)
-                for (rhs_r, rhs_lineage) in self.rhs.eval(db)}
+    # override.
+    def _eval(self, db: Database, memo: Memo) -> WbQueryOutput:
+        lhs = self.lhs.eval(db, memo)
+        if len(lhs) == 0:
+            return set()
+        rhs = self.rhs.eval(db, memo)
+        return {(lhs_r + rhs_r, _union(lhs_lineage, rhs_lineage))
+                for (lhs_r, lhs_lineage) in lhs
+                for (rhs_r, rhs_lineage) in rhs}
+
+    # override.
+    def key(self) -> Hashable:
+        return ('cross', self.lhs.key(), self.rhs.key())
 
     def __str__(self) -> str:
         return f'Cross({self.lhs}, {self.rhs})'
@@ -150,13 +315,106 @@ class WbCross(WbQuery):
     def __repr__(self) -> str:
         return str(self)
 
+class WbJoin(WbQuery):
+    """An equijoin, computed with a hash join.
+
+    lhs.join(rhs, [0], [1]) is (lhs * rhs).select(lambda r: r[0] == r[n + 1]),
+    where n is the arity of lhs, but it does not build the cross product. If
+    either side is a relation with an index on the joined columns, the other
+    side's records are looked up in the index instead, so the indexed relation
+    is not scanned.
+    """
+    def __init__(self,
+                 lhs: Coercible,
+                 rhs: Coercible,
+                 lhs_columns: List[int],
+                 rhs_columns: List[int]) -> None:
+        assert len(lhs_columns) == len(rhs_columns), (lhs_columns, rhs_columns)
+        self.lhs = coerce(lhs)
+        self.rhs = coerce(rhs)
+        self.lhs_columns: Columns = tuple(lhs_columns)
+        self.rhs_columns: Columns = tuple(rhs_columns)
+
+    # override.
+    def _eval(self, db: Database, memo: Memo) -> WbQueryOutput:
+        lhs_index = _indexed(self.lhs, self.lhs_columns, db)
+        rhs_index = _indexed(self.rhs, self.rhs_columns, db)
+        if lhs_index is not None and rhs_index is not None:
+            # Look up the records of the smaller relation in the larger one.
+            if len(db[lhs_index]) < len(db[rhs_index]):
+                lhs_index = None
+            else:
+                rhs_index = None
+
+        if rhs_index is not None:
+            lhs = self.lhs.eval(db, memo)
+            relation = db[rhs_index]
+            return {(lhs_r + tr.record,
+                     _union(lhs_lineage, (tr.id,)))
+                    for (lhs_r, lhs_lineage) in lhs
+                    for tr in relation.lookup(
+                        self.rhs_columns,
+                        tuple(lhs_r[i] for i in self.lhs_columns))}
+
+        if lhs_index is not None:
+            relation = db[lhs_index]
+            if len(relation) == 0:
+                return set()
+            rhs = self.rhs.eval(db, memo)
+            return {(tr.record + rhs_r,
+                     _union((tr.id,), rhs_lineage))
+                    for (rhs_r, rhs_lineage) in rhs
+                    for tr in relation.lookup(
+                        self.lhs_columns,
+                        tuple(rhs_r[i] for i in self.rhs_columns))}
+
+        lhs = self.lhs.eval(db, memo)
+        if len(lhs) == 0:
+            return set()
+
+        table: Dict[Record, List[Tuple[Record, Witness]]] = dict()
+        for rhs_r, rhs_lineage in self.rhs.eval(db, memo):
+            key = tuple(rhs_r[i] for i in self.rhs_columns)
+            table.setdefault(key, []).append((rhs_r, rhs_lineage))
+
+        return {(lhs_r + rhs_r, _union(lhs_lineage, rhs_lineage))
+                for (lhs_r, lhs_lineage) in lhs
+                for (rhs_r, rhs_lineage) in
+                    table.get(tuple(lhs_r[i] for i in self.lhs_columns), [])}
+
+    # override.
+    def key(self) -> Hashable:
+        return ('join', self.lhs.key(), self.rhs.key(),
+                self.lhs_columns, self.rhs_columns)
+
+    def __str__(self) -> str:
+        return (f'Join({self.lhs}, {self.rhs}, {list(self.lhs_columns)}, '
+                f'{list(self.rhs_columns)})')
+
+    def __repr__(self) -> str:
+        return str(self)
+
+def _indexed(query: WbQuery, columns: Columns, db: Database) \
+             -> Optional[RelationName]:
+    """Returns query's relation if it is a relation indexed on columns."""
+    if not isinstance(query, WbRelation):
+        return None
+    if db[query.R].has_index(columns):
+        return query.R
+    return None
+
 class WbCup(WbQuery):
     def __init__(self, lhs: Coercible, rhs: Coercible) -> None:
         self.lhs = coerce(lhs)
         self.rhs = coerce(rhs)
 
-    def eval(self, db: Database) -> WbQueryOutput:
-        return self.lhs.eval(db) | self.rhs.eval(db)
+    # override.
+    def _eval(self, db: Database, memo: Memo) -> WbQueryOutput:
+        return self.lhs.eval(db, memo) | self.rhs.eval(db, memo)
+
+    # override.
+    def key(self) -> Hashable:
+        return ('cup', self.lhs.key(), self.rhs.key())
 
     def __str__(self) -> str:
         return f'Cup({self.lhs}, {self.rhs})'
@@ -169,18 +427,37 @@ class WbDiff(WbQuery):
         self.lhs = coerce(lhs)
         self.rhs = coerce(rhs)
 
-    def eval(self, db: Database) -> WbQueryOutput:
-        rhs_records = {r for r, _ in self.rhs.eval(db)}
+    # override.
+    def _eval(self, db: Database, memo: Memo) -> WbQueryOutput:
+        rhs_records = {r for r, _ in self.rhs.eval(db, memo)}
         return {(r, lineage)
-                for (r, lineage) in self.lhs.eval(db)
+                for (r, lineage) in self.lhs.eval(db, memo)
                 if r not in rhs_records}
 
+    # override.
+    def key(self) -> Hashable:
+        return ('diff', self.lhs.key(), self.rhs.key())
+
     def __str__(self) -> str:
         return f'Diff({self.lhs}, {self.rhs})'
 
     def __repr__(self) -> str:
         return str(self)
 
+def _delta(name: RelationName, query: WbQuery) \
+           -> Optional[Tuple[bool, WbQuery]]:
+    """Returns (True, E) if query is name + E and (False, E) if name - E."""
+    def is_target(q: WbQuery) -> bool:
+        return isinstance(q, WbRelation) and q.R == name
+
+    if isinstance(query, WbCup) and is_target(query.lhs):
+        return (True, query.rhs)
+    if isinstance(query, WbCup) and is_target(query.rhs):
+        return (True, query.lhs)
+    if isinstance(query, WbDiff) and is_target(query.lhs):
+        return (False, query.rhs)
+    return None
+
 # White Box ####################################################################
 class Rule(NamedTuple):
     relation_name: RelationName
@@ -196,34 +473,83 @@ class Output(NamedTuple):
 EnumeratedTrace = List[Tuple[int, Input, Output]]
 
 class WhiteBox(StateMachine[Input, Output]):
-    def __init__(self) -> None:
+    """A state machine of relations and rules that tracks lineage.
+
+    By default, every rule is evaluated in full, and the relation it writes
+    into is rewritten with a fresh copy of every record in the result. If
+    incremental is True, a rule of the form R + E or R - E that writes into R
+    is instead evaluated by evaluating E and inserting or deleting its records
+    from R, leaving R's other records as they are. Those records would
+    otherwise be copied with a lineage of just their older copy, so the
+    outputs and get_output_lineage are the same in both modes, but the cost
+    of such a rule grows with E rather than with R.
+    """
+    def __init__(self, incremental: bool = False) -> None:
+        self.incremental = incremental
         self.timestamp = Timestamp(0, 0)
         self.schema: Schema = dict()
         self.db: Database = dict()
+        self.indexes: Dict[RelationName, List[Columns]] = dict()
         self.rules: Dict[RelationName, List[Rule]] = dict()
-        self.lineage: Dict[RecordId, Lineage] = dict()
+        self.lineage: CowDict[int, Lineage] = CowDict()
+        self.next_id = 0
         self.inputs: Dict[int, Input] = dict()
         self.outputs: Dict[int, Output] = dict()
         self.output_lineage: Dict[int, Dict[RecordId, Lineage]] = dict()
-
-    def create_table(self, name: RelationName, arity: Arity) -> None:
+        self.stats: Optional[WhiteBoxStats] = None
+
+    def create_table(self,
+                     name: RelationName,
+                     arity: Arity,
+                     indexes: Optional[List[List[int]]] = None) \
+                     -> None:
+        """Creates a relation with a hash index on each list of columns.
+
+        Joins on exactly the columns of an index look records up in the
+        index rather than scanning the relation.
+        """
         assert name not in self.schema, (name, self.schema)
+        columns = [tuple(index) for index in (indexes or [])]
+        for index in columns:
+            assert len(index) > 0, (name, indexes)
+            assert all(0 <= i < arity for i in index), (name, arity, indexes)
         self.schema[name] = arity
-        self.db[name] = set()
+        self.indexes[name] = columns
+        self.db[name] = Relation(indexes=columns)
 
     def register_rules(self, name: RelationName, rules: List[Rule]) -> None:
         assert name not in self.rules, (name, self.rules)
         assert len(rules) > 0, rules
         self.rules[name] = rules
 
-    def _flatten_lineage(self, lineage: Lineage) -> Set[RecordId]:
-        output: Set[RecordId] = set()
-        for witness in lineage:
-            for rid in witness:
-                if rid.timestamp.step == 0:
-                    output.add(rid)
-                else:
-                    output |= self._flatten_lineage(self.lineage[rid])
+        if self.incremental:
+            # Deleting records looks them up in an index on every column.
+            for relation_name, query in rules:
+                delta = _delta(relation_name, query)
+                if delta is not None and not delta[0]:
+                    self._add_index(relation_name,
+                                    tuple(range(self.schema[relation_name])))
+
+    def _add_index(self, name: RelationName, columns: Columns) -> None:
+        if columns not in self.indexes[name]:
+            self.indexes[name].append(columns)
+            self.db[name] = Relation(self.db[name], self.indexes[name])
+
+    def _flatten_lineage(self, lineage: Lineage) -> Set[int]:
+        """Returns the ids of the requests that lineage derives from."""
+        output: Set[int] = set()
+        visited: Set[int] = set()
+        stack = [lineage]
+        while len(stack) > 0:
+            for witness in stack.pop():
+                for id in witness:
+                    if id in visited:
+                        continue
+                    visited.add(id)
+                    if _is_request_id(id):
+                        output.add(id)
+                    else:
+                        stack.append(self.lineage[id])
         return output
 
     def get_output_lineage(self, j: int) -> Dict[RecordId, EnumeratedTrace]:
@@ -231,18 +557,80 @@ class WhiteBox(StateMachine[Input, Output]):
 
         ans: Dict[RecordId, EnumeratedTrace] = dict()
         for rid, lineage in self.output_lineage[j].items():
-            rids = self._flatten_lineage(lineage)
-            indexes = sorted(rid.timestamp.tick
-                             for rid in rids
-                             if rid.timestamp.tick != j)
+            ids = self._flatten_lineage(lineage)
+            indexes = sorted(_id_tick(id) for id in ids if _id_tick(id) != j)
             ans[rid] = [(j, self.inputs[j], self.outputs[j]) for j in indexes]
         return ans
 
+    def _eval_rule(self, request: RelationName, index: int, query: WbQuery) \
+                   -> WbQueryOutput:
+        if self.stats is None:
+            return query.eval(self.db)
+
+        start = time.perf_counter()
+        ans = query.eval(self.db)
+        stats = self.stats.rule(request, index)
+        stats.evaluations += 1
+        stats.seconds += time.perf_counter() - start
+        lineage_sizes = Counter(r for r, lineage in ans)
+        stats.records += len(lineage_sizes)
+        stats.witnesses += len(ans)
+        if len(lineage_sizes) > 0:
+            stats.max_lineage = max(stats.max_lineage,
+                                    max(lineage_sizes.values()))
+        return ans
+
+    def _insert(self, name: RelationName, ans: WbQueryOutput) -> None:
+        ids: Dict[Record, int] = dict()
+        for r, lineage in ans:
+            # Record the record.
+            if r not in ids:
+                ids[r] = self.next_id
+                self.next_id += 1
+                self.db[name].add(TimestampedRecord(r, self.timestamp, ids[r]))
+                self.lineage[ids[r]] = set()
+
+            # Record the lineage.
+            self.lineage[ids[r]].add(lineage)
+
+    def _delete(self, name: RelationName, records: Set[Record]) -> None:
+        relation = self.db[name]
+        columns = tuple(range(self.schema[name]))
+        if relation.has_index(columns):
+            stale = [tr for r in records for tr in relation.lookup(columns, r)]
+        else:
+            stale = [tr for tr in relation if tr.record in records]
+        for tr in stale:
+            relation.discard(tr)
+
+    # override.
+    def configuration(self) -> Tuple[Schema, Dict[RelationName, List[Rule]]]:
+        return (self.schema, self.rules)
+
     # override.
     def reset(self) -> None:
         self.timestamp = Timestamp(0, 0)
-        self.db = {name: set() for name in self.schema}
-        self.lineage = dict()
+        self.db = {name: Relation(indexes=self.indexes[name])
+                   for name in self.schema}
+        self.lineage = CowDict()
+
+    # override.
+    def snapshot(self) -> Tuple[Timestamp, Database, CowDict[int, Lineage]]:
+        # The relations and the lineage are persistent, so copying them takes
+        # O(1) time per relation. The lineage of a record is only ever
+        # modified during the step that produces it, so the lineage sets
+        # themselves can be shared.
+        db = {name: relation.copy() for (name, relation) in self.db.items()}
+        return (self.timestamp, db, self.lineage.copy())
+
+    # override.
+    def restore(self,
+                state: Tuple[Timestamp, Database, CowDict[int, Lineage]]) \
+                -> None:
+        timestamp, db, lineage = state
+        self.timestamp = timestamp
+        self.db = {name: relation.copy() for (name, relation) in db.items()}
+        self.lineage = lineage.copy()
 
     # override.
     def transition(self, i: Input) -> Output:
@@ -254,37 +642,46 @@ class WhiteBox(StateMachine[Input, Output]):
         self.inputs[self.timestamp.tick] = i
 
         # Add the request to the request table.
-        tr = TimestampedRecord(i.record, self.timestamp)
+        self.next_id = _first_id(self.timestamp.tick)
+        tr = TimestampedRecord(i.record, self.timestamp, self.next_id)
         self.db[i.relation_name].add(tr)
+        self.next_id += 1
+
+        if self.stats is not None:
+            self.stats.transitions += 1
 
         # Run all but the last rule.
-        for name, query in self.rules[i.relation_name][:-1]:
+        rules = self.rules[i.relation_name]
+        for index, (name, query) in enumerate(rules[:-1]):
             # Increment the step before each step.
             self.timestamp = self.timestamp.increment_step()
 
+            delta = _delta(name, query) if self.incremental else None
+            if delta is not None:
+                # Run the query's delta, and insert or delete its records.
+                insert, delta_query = delta
+                ans = self._eval_rule(i.relation_name, index, delta_query)
+                if insert:
+                    self._insert(name, ans)
+                else:
+                    self._delete(name, {r for r, lineage in ans})
+                continue
+
             # Run the query.
-            ans = query.eval(self.db)
+            ans = self._eval_rule(i.relation_name, index, query)
             records = {r for r, lineage in ans}
 
-            # Clear the relation being written into.
-            self.db[name] = {tr for tr in self.db[name]
-                                if tr.record in records}
-
-            for r, lineage in ans:
-                # Record the record.
-                tr = TimestampedRecord(r, self.timestamp)
-                self.db[name].add(tr)
-
-                # Record the lineage.
-                rid = RecordId(name, r, self.timestamp)
-                if rid not in self.lineage:
-                    self.lineage[rid] = set()
-                self.lineage[rid].add(lineage)
+            # Clear the relation being written into. The relation is updated
+            # in place, which keeps its indexes up to date.
+            stale = [tr for tr in self.db[name] if tr.record not in records]
+            for tr in stale:
+                self.db[name].discard(tr)
+            self._insert(name, ans)
 
         # Run the last query.
-        name, query = self.rules[i.relation_name][-1]
+        name, query = rules[-1]
         self.timestamp = self.timestamp.increment_step()
-        ans = query.eval(self.db)
+        ans = self._eval_rule(i.relation_name, len(rules) - 1, query)
 
         # Store the output's lineage.
         output_lineage: Dict[RecordId, Lineage] = dict()
@@ -303,6 +700,6 @@ class WhiteBox(StateMachine[Input, Output]):
         self.timestamp = self.timestamp.increment_tick()
 
         # Clear the request table.
-        self.db[i.relation_name] = set()
+        self.db[i.relation_name].clear()
 
         return output